@@ -1,56 +1,516 @@
 import io
 import os
 import csv
-import base64
+import click
+import json
+import queue
+import atexit
+import mmap
+import mimetypes
+import multiprocessing
+import time
+import secrets
+import sqlite3
+import struct
+import sys
+import hashlib
 import logging
-import numpy as np
-import matplotlib.pyplot as plt
-from matplotlib.ticker import MaxNLocator
-from datetime import datetime, timedelta
-from flask import Flask, redirect, url_for, render_template, flash, request, session
+import logging.handlers
+import threading
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FuturesTimeoutError
+from datetime import datetime, timedelta, timezone
+from flask import Flask, Blueprint, current_app, redirect, url_for, render_template, flash, request, session, make_response, jsonify, send_from_directory, g, has_request_context
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import IntegrityError, OperationalError
 from flask_wtf import FlaskForm
-from flask_wtf.csrf import CSRFProtect
+from flask_wtf.csrf import CSRFProtect, generate_csrf
 from flask_login import LoginManager, UserMixin, current_user, login_required, login_user, logout_user
 from wtforms import StringField, PasswordField, SubmitField
 from wtforms.validators import InputRequired, Length, ValidationError
+from jinja2 import FileSystemBytecodeCache
+from markupsafe import Markup, escape
+from werkzeug.security import safe_join
 from argon2 import PasswordHasher
-from argon2.exceptions import VerifyMismatchError
+from argon2.exceptions import InvalidHashError, VerifyMismatchError
 
 ## Initial Setup
 
-# setup flask app
-app = Flask(__name__)
+# routes, hooks and CLI commands register on this blueprint and the
+# extensions are unbound; create_app() puts them together (cli_group=None
+# keeps commands at `flask --app app <command>`)
+bp = Blueprint('main', __name__, cli_group=None)
 csrf = CSRFProtect()
-csrf.init_app(app)
-
-# store session data for 5 min; works even if browser is open
-app.permanent_session_lifetime = timedelta(minutes=5)
-
-# setup database
-app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL')
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY')
-
-# uncomment for creating new database from scratch
-if 'sqlalchemy' in app.extensions:
-    del app.extensions['sqlalchemy']
-
-# instantiate database
-db = SQLAlchemy(app)
-
-# logging for file and console
-def logs():
-    if not os.path.exists('logs'):
-        os.makedirs('logs')
-    log_file = os.path.join('logs', f"{datetime.now().strftime('%Y%m%d_%H%M%SMT')}.log")
-    log_format = '%(asctime)s - %(levelname)s - %(message)s'
-    logging.basicConfig(filename=log_file, level=logging.INFO, format=log_format)
+db = SQLAlchemy()
+
+def default_config(app):
+    """Settings from the environment; paths default to app's instance/static folders."""
+    return {
+        # store session data for 5 min; works even if browser is open
+        'PERMANENT_SESSION_LIFETIME': timedelta(minutes=5)
+        # setup database
+        , 'SQLALCHEMY_DATABASE_URI': os.environ.get('DATABASE_URL')
+        , 'SQLALCHEMY_TRACK_MODIFICATIONS': False
+        , 'SECRET_KEY': os.environ.get('SECRET_KEY')
+        # server-side "current pun" store (see make_pun_store); cookie holds a key only
+        , 'PUN_STORE': os.environ.get('PUN_STORE', 'memory')  # or 'sqlite'
+        , 'PUN_STORE_PATH': os.environ.get('PUN_STORE_PATH', os.path.join(app.instance_path, 'pun_store.db'))
+        , 'PUN_STORE_SIZE': int(os.environ.get('PUN_STORE_SIZE', 10000))
+        # compiled templates persist across worker restarts
+        , 'JINJA_CACHE_DIR': os.environ.get('JINJA_CACHE_DIR', os.path.join(app.instance_path, 'jinja_cache'))
+        # fingerprinted assets built by utils/build_assets.py
+        , 'ASSET_MANIFEST': os.path.join(app.static_folder, 'dist', 'manifest.json')
+        # WebP/AVIF variants of the GIFs written by utils/transcode_media.py
+        , 'MEDIA_REPORT': os.path.join(app.static_folder, 'media.json')
+        # compiled pun catalog (see compile_pun_catalog); Puns table is the fallback
+        , 'PUN_CATALOG': os.environ.get('PUN_CATALOG', os.path.join('static', 'files', 'puns.bin'))
+    }
+
+# connection pool, sized explicitly for threaded servers: one connection
+# per request thread plus the background writers, with a little overflow
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 8))
+DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', 4))
+DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 10))
+
+# SQLite profile: 'production' sets SQLITE_PRAGMAS on every new connection
+# (see set_sqlite_pragmas); 'default' leaves SQLite's defaults alone
+SQLITE_PROFILE = os.environ.get('SQLITE_PROFILE', 'production')
+SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', 5000))
+SQLITE_PRAGMAS = [
+    # readers keep reading while a rating is being written
+    'PRAGMA journal_mode=WAL'
+    # durable at checkpoints; safe from corruption in WAL mode
+    , 'PRAGMA synchronous=NORMAL'
+    # wait for the write lock instead of failing with "database is locked"
+    , f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}"
+    , f"PRAGMA mmap_size={int(os.environ.get('SQLITE_MMAP_SIZE', 256 * 1024 * 1024))}"
+    # negative: KiB rather than pages
+    , f"PRAGMA cache_size=-{int(os.environ.get('SQLITE_CACHE_KIB', 64 * 1024))}"
+    , 'PRAGMA temp_store=MEMORY'
+]
+
+def is_memory_sqlite(uri):
+    return uri in ('sqlite://', 'sqlite:///:memory:') or 'mode=memory' in uri
+
+def database_engine_options(database_uri):
+    """Explicit pool sizing; {} for in-memory SQLite (a per-thread pool that can't be sized)."""
+    if not database_uri or is_memory_sqlite(database_uri):
+        return {}
+    engine_options = {
+        'pool_size': DB_POOL_SIZE
+        , 'max_overflow': DB_MAX_OVERFLOW
+        , 'pool_timeout': DB_POOL_TIMEOUT
+    }
+    if database_uri.startswith('sqlite'):
+        # sqlite3's own lock wait, in seconds (busy_timeout covers the rest)
+        engine_options['connect_args'] = {'timeout': SQLITE_BUSY_TIMEOUT_MS / 1000}
+    return engine_options
+
+@event.listens_for(Engine, 'connect')
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    """Applies the SQLite profile to each new pooled connection."""
+    if SQLITE_PROFILE != 'production' or not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    cursor = dbapi_connection.cursor()
+    for pragma in SQLITE_PRAGMAS:
+        cursor.execute(pragma)
+    cursor.close()
+
+def sqlite_maintenance(mode='TRUNCATE'):
+    """Checkpoints the WAL into the database file and refreshes the query
+    planner's statistics. Returns (busy, wal_frames, checkpointed_frames).
+    """
+    with db.engine.connect() as conn:
+        result = tuple(conn.exec_driver_sql(f"PRAGMA wal_checkpoint({mode})").one())
+        conn.exec_driver_sql('PRAGMA optimize')
+    logging.info(f"SQLite maintenance: checkpoint {mode} (busy, wal frames, checkpointed) = {result}.")
+    return result
+
+@bp.cli.command('sqlite-maintenance')
+@click.option('--mode', default='TRUNCATE', type=click.Choice(['PASSIVE', 'FULL', 'RESTART', 'TRUNCATE']))
+def sqlite_maintenance_command(mode):
+    """Checkpoint the WAL and run PRAGMA optimize (e.g. hourly from cron)."""
+    busy, wal_frames, checkpointed = sqlite_maintenance(mode)
+    click.echo(f"Checkpointed {checkpointed} of {wal_frames} WAL frames{' (busy)' if busy else ''}.")
+
+# heavy plotting deps are imported on first use (only /stats needs them)
+_plotting = {}
+
+def load_plotting():
+    """Imports matplotlib once per process and returns (Figure, MaxNLocator)."""
+    if not _plotting:
+        # Figure objects instead of pyplot: pyplot's global figure manager
+        # isn't thread-safe, and each render owns its figure outright
+        from matplotlib.figure import Figure
+        from matplotlib.ticker import MaxNLocator
+        _plotting['Figure'] = Figure
+        _plotting['MaxNLocator'] = MaxNLocator
+    return _plotting['Figure'], _plotting['MaxNLocator']
+
+def warm_up():
+    """Optional hook for workers that prefer to pre-pay heavy imports,
+    e.g. from a gunicorn post_fork hook or with WARM_UP=1.
+    """
+    load_plotting()
+
+# logging for file and console: request threads only enqueue records, a
+# listener thread formats and writes them
+LOG_FILE = os.environ.get('LOG_FILE', os.path.join('logs', 'app.log'))
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO')
+LOG_MAX_BYTES = int(os.environ.get('LOG_MAX_BYTES', 10 * 1024 * 1024))
+LOG_ROTATE_SECONDS = int(os.environ.get('LOG_ROTATE_SECONDS', 24 * 60 * 60))
+LOG_BACKUPS = int(os.environ.get('LOG_BACKUPS', 14))
+LOG_QUEUE_SIZE = int(os.environ.get('LOG_QUEUE_SIZE', 10000))
+# 'text' or 'json' (one object per line)
+LOG_FORMAT = os.environ.get('LOG_FORMAT', 'text')
+# fraction of INFO/DEBUG records kept; warnings and errors are always kept
+LOG_SAMPLE_RATE = float(os.environ.get('LOG_SAMPLE_RATE', 1.0))
+
+class RotatingLogHandler(logging.handlers.RotatingFileHandler):
+    """Rolls over at max_bytes or every interval seconds, whichever comes first."""
+
+    def __init__(self, filename, max_bytes, interval, backup_count):
+        super().__init__(filename, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8', delay=True)
+        self.interval = interval
+        self.rollover_at = time.time() + interval
+
+    def shouldRollover(self, record):
+        if self.interval and time.time() >= self.rollover_at:
+            return True
+        return super().shouldRollover(record)
+
+    def doRollover(self):
+        super().doRollover()
+        self.rollover_at = time.time() + self.interval
+
+class JsonLogFormatter(logging.Formatter):
+    """One JSON object per record."""
+
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds')
+            , 'level': record.levelname
+            , 'logger': record.name
+            , 'message': record.getMessage()
+            , 'thread': record.threadName
+        }
+        if record.exc_info:
+            entry['exc_info'] = self.formatException(record.exc_info)
+        return json.dumps(entry)
+
+class SampleFilter(logging.Filter):
+    """Keeps a LOG_SAMPLE_RATE fraction of records below WARNING."""
+
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        return record.levelno >= logging.WARNING or secrets.randbelow(1000000) < self.rate * 1000000
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """Drops records (instead of blocking the request) when the queue is full."""
+
+    def prepare(self, record):
+        # the queue never leaves the process, so nothing needs pickling:
+        # pass the record as is and let the listener's handlers format it
+        # (message, traceback) off the request thread
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            pass
+
+def logs(log_file=LOG_FILE):
+    """Routes the root logger through a queue to a rotating file and the
+    console; returns the started QueueListener (stop it to flush).
+    """
+    log_dir = os.path.dirname(log_file)
+    if log_dir and not os.path.exists(log_dir):
+        os.makedirs(log_dir)
+    if LOG_FORMAT == 'json':
+        formatter = JsonLogFormatter()
+    else:
+        formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
+    file_handler = RotatingLogHandler(log_file, LOG_MAX_BYTES, LOG_ROTATE_SECONDS, LOG_BACKUPS)
     console_handler = logging.StreamHandler()
-    console_handler.setLevel(logging.INFO)
-    formatter = logging.Formatter(log_format)
-    console_handler.setFormatter(formatter)
-    return console_handler
+    for handler in (file_handler, console_handler):
+        handler.setFormatter(formatter)
+    queue_handler = DroppingQueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+    if LOG_SAMPLE_RATE < 1:
+        queue_handler.addFilter(SampleFilter(LOG_SAMPLE_RATE))
+    root = logging.getLogger()
+    root.setLevel(LOG_LEVEL)
+    # a forked worker inherits the master's handlers (a queue handler
+    # without its listener thread, or the stderr handler logging adds when
+    # preload logs before logs() ran), so replace them
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    listener = logging.handlers.QueueListener(queue_handler.queue, file_handler, console_handler)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
+
+# (pid, lock file) held for the life of a worker, so no other live worker
+# takes its slot
+_log_slot = None
+
+def worker_logs():
+    """Starts a prefork worker's log listener on the lowest free LOG_FILE
+    slot (logs/app.0.log, app.1.log, ...). Workers sharing one file would
+    rotate it under each other; a restarted worker reuses a freed slot,
+    so the number of files stays bounded by the number of workers.
+    Returns None if this worker already started its listener.
+    """
+    global _log_slot
+    if _log_slot is not None and _log_slot[0] == os.getpid():
+        return None
+    try:
+        import fcntl
+    except ImportError:
+        # no fork() on this platform, so no prefork workers either
+        return logs()
+    root, ext = os.path.splitext(LOG_FILE)
+    log_dir = os.path.dirname(LOG_FILE)
+    if log_dir:
+        os.makedirs(log_dir, exist_ok=True)
+    slot = 0
+    while True:
+        slot_file = open(f"{root}.{slot}.lock", 'w')
+        try:
+            fcntl.flock(slot_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            break
+        except BlockingIOError:
+            slot_file.close()
+            slot += 1
+    _log_slot = (os.getpid(), slot_file)
+    return logs(f"{root}.{slot}{ext}")
+
+def utc_now():
+    """Naive UTC datetime, as stored in DateTime columns."""
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+## SQL Instrumentation
+
+# opt-in: per-request statement count, DB time and slowest statements,
+# in an X-SQL-Stats / Server-Timing header and the logs
+SQL_INSTRUMENTATION = os.environ.get('SQL_INSTRUMENTATION', '0') == '1'
+# log a warning when a single statement takes longer than this
+SQL_SLOW_MS = float(os.environ.get('SQL_SLOW_MS', 100))
+# identical statement text run this often in one request looks like N+1
+SQL_REPEAT_THRESHOLD = int(os.environ.get('SQL_REPEAT_THRESHOLD', 2))
+SQL_SLOWEST = int(os.environ.get('SQL_SLOWEST', 3))
+
+# the start time lives on the statement's execution context, not the
+# pooled connection: a statement that raises never reaches
+# after_cursor_execute, and its start time goes away with the context
+def sql_statement_started(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context.sql_started = time.perf_counter()
+
+def sql_statement_finished(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, 'sql_started', None)
+    if started is None:
+        return
+    elapsed = time.perf_counter() - started
+    # background threads (write-behind, rollups) have no request to charge
+    if not has_request_context():
+        return
+    stats = g.setdefault('sql_stats', {'count': 0, 'seconds': 0.0, 'statements': {}})
+    stats['count'] += 1
+    stats['seconds'] += elapsed
+    # per statement text: [count, total seconds, slowest seconds]
+    entry = stats['statements'].setdefault(statement, [0, 0.0, 0.0])
+    entry[0] += 1
+    entry[1] += elapsed
+    entry[2] = max(entry[2], elapsed)
+
+if SQL_INSTRUMENTATION:
+    event.listen(Engine, 'before_cursor_execute', sql_statement_started)
+    event.listen(Engine, 'after_cursor_execute', sql_statement_finished)
+
+def get_sql_stats():
+    """Summary of the current request's statements: count, time, slowest, repeated."""
+    stats = g.get('sql_stats', {'count': 0, 'seconds': 0.0, 'statements': {}})
+    statements = stats['statements'].items()
+    slowest = sorted(statements, key=lambda item: item[1][2], reverse=True)[:SQL_SLOWEST]
+    return {
+        'count': stats['count']
+        , 'time_ms': round(1000 * stats['seconds'], 2)
+        , 'slowest': [
+            {'statement': ' '.join(text.split())[:200], 'ms': round(1000 * slowest_s, 2), 'count': count}
+            for text, (count, _, slowest_s) in slowest
+        ]
+        , 'repeated': [
+            {'statement': ' '.join(text.split())[:200], 'count': count}
+            for text, (count, _, _) in statements if count >= SQL_REPEAT_THRESHOLD
+        ]
+    }
+
+@bp.after_app_request
+def report_sql_stats(response):
+    """Adds X-SQL-Stats and Server-Timing headers and logs the request's SQL."""
+    if not SQL_INSTRUMENTATION:
+        return response
+    stats = get_sql_stats()
+    response.headers['X-SQL-Stats'] = (
+        f"count={stats['count']}; time_ms={stats['time_ms']}; repeated={len(stats['repeated'])}"
+    )
+    response.headers.add('Server-Timing', f"db;dur={stats['time_ms']};desc=\"{stats['count']} queries\"")
+    endpoint = f"{request.method} {request.path}"
+    logging.info("SQL %s: %s statements in %sms", endpoint, stats['count'], stats['time_ms'])
+    for repeated in stats['repeated']:
+        logging.warning("Possible N+1 in %s: %sx %s", endpoint, repeated['count'], repeated['statement'])
+    for slow in stats['slowest']:
+        if slow['ms'] >= SQL_SLOW_MS:
+            logging.warning("Slow SQL in %s: %sms %s", endpoint, slow['ms'], slow['statement'])
+    return response
+
+## Metrics
+
+# Prometheus text format at /metrics, per process (scrape each worker, or
+# sum them); only served to METRICS_ALLOWED_IPS, which is empty unless set:
+# behind a reverse proxy every client looks like 127.0.0.1, so only list
+# addresses that request.remote_addr really distinguishes (a direct bind
+# the proxy doesn't forward to, or a proxy-aware remote_addr via ProxyFix)
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', '1') == '1'
+METRICS_ALLOWED_IPS = {ip for ip in os.environ.get('METRICS_ALLOWED_IPS', '').split(',') if ip}
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def format_labels(names, values, extra=''):
+    """{name="value",...} for a sample line, '' without labels."""
+    pairs = [f'{name}="{escape_label(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+class Counter:
+    """Monotonic counter per label values."""
+
+    def __init__(self, name, help, labels=()):
+        self.name, self.help, self.labels = name, help, labels
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def inc(self, label_values=(), amount=1):
+        with self.lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self.lock:
+            values = list(self.values.items())
+        for label_values, value in sorted(values):
+            lines.append(f"{self.name}{format_labels(self.labels, label_values)} {value}")
+        return lines
+
+class Histogram:
+    """Fixed-bucket histogram per label values. A series' counts live in
+    preallocated arrays, so observe() is a bisect plus two array updates
+    under a short lock; cumulative buckets are only built when scraped.
+    """
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name, self.help, self.labels, self.buckets = name, help, labels, buckets
+        self.lock = threading.Lock()
+        # label values -> (per-bucket counts incl. +Inf, [sum])
+        self.series = {}
+
+    def observe(self, value, label_values=()):
+        index = bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.series.get(label_values)
+            if series is None:
+                series = self.series[label_values] = (
+                    array('Q', [0]) * (len(self.buckets) + 1), array('d', [0.0])
+                )
+            series[0][index] += 1
+            series[1][0] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            snapshot = [(label_values, list(counts), sums[0]) for label_values, (counts, sums) in self.series.items()]
+        for label_values, counts, total in sorted(snapshot):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = 'le="+Inf"' if bound == float('inf') else f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{format_labels(self.labels, label_values, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{format_labels(self.labels, label_values)} {total}")
+            lines.append(f"{self.name}_count{format_labels(self.labels, label_values)} {cumulative}")
+        return lines
+
+request_duration = Histogram(
+    'puns_http_request_duration_seconds', "Request latency by endpoint.", labels=('endpoint',)
+)
+responses_total = Counter(
+    'puns_http_responses_total', "Responses by endpoint and status code.", labels=('endpoint', 'status')
+)
+ratings_written = Counter('puns_ratings_written_total', "Ratings committed to the database.")
+argon2_duration = Histogram(
+    'puns_argon2_duration_seconds', "Password hash/verify time, including pool wait."
+    , labels=('operation',), buckets=(0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+)
+chart_render_duration = Histogram('puns_stats_chart_render_seconds', "Stats chart render time (cache misses).")
+identity_lookups = Counter(
+    'puns_identity_lookups_total', "Logged-in user lookups by source (cache, snapshot or database)."
+    , labels=('source',)
+)
+
+@bp.before_app_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@bp.after_app_request
+def record_request_metrics(response):
+    started = g.get('request_started')
+    if METRICS_ENABLED and started is not None:
+        endpoint = request.endpoint or 'unmatched'
+        request_duration.observe(time.perf_counter() - started, (endpoint,))
+        responses_total.inc((endpoint, response.status_code))
+    return response
+
+def render_pool_gauges():
+    """Connection pool gauges, read at scrape time."""
+    pool = db.engine.pool
+    lines = []
+    for name, method, help in [
+        ('puns_db_pool_size', 'size', "Configured pool size.")
+        , ('puns_db_pool_checked_out', 'checkedout', "Connections currently checked out.")
+        , ('puns_db_pool_overflow', 'overflow', "Connections beyond pool_size (negative while the pool fills).")
+    ]:
+        # only QueuePool-style pools report these
+        if hasattr(pool, method):
+            lines += [f"# HELP {name} {help}", f"# TYPE {name} gauge", f"{name} {getattr(pool, method)()}"]
+    return lines
+
+@bp.route('/metrics', methods=["GET"])
+def metrics():
+    """Prometheus scrape endpoint for this process."""
+    if not METRICS_ENABLED or request.remote_addr not in METRICS_ALLOWED_IPS:
+        return make_response('Not Found', 404)
+    lines = []
+    for metric in [
+        request_duration, responses_total, ratings_written, argon2_duration, chart_render_duration
+        , identity_lookups
+    ]:
+        lines += metric.render()
+    lines += render_pool_gauges()
+    response = make_response('\n'.join(lines) + '\n')
+    response.mimetype = 'text/plain'
+    response.headers['Content-Type'] = 'text/plain; version=0.0.4; charset=utf-8'
+    return response
 
 # Define Database Schema
 
@@ -68,7 +528,7 @@ class User(db.Model, UserMixin):
         self.password = password
 
 class Puns(db.Model):
-    """Static: filled by insert_into_puns()"""
+    """Static: filled by sync_puns()"""
     id = db.Column(db.Integer, primary_key=True)
     question = db.Column(db.String(255), nullable=False)
     answer = db.Column(db.String(255), nullable=False)
@@ -76,28 +536,84 @@ class Puns(db.Model):
     # define relationship to the "Ratings" table
     ratings = db.relationship('Ratings', backref='puns', lazy=True)
 
-def insert_puns():
+class CatalogState(db.Model):
+    """Static: checksum of the last catalog file applied by sync_puns()"""
+    name = db.Column(db.String(64), primary_key=True)
+    checksum = db.Column(db.String(64), nullable=False)
+
+def pun_row_hash(question, answer, blame):
+    """Content hash of a single pun, used to diff the CSV against Puns."""
+    content = '\x1f'.join([question, answer, blame or ''])
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+def file_checksum(path, chunk_size=1 << 16):
+    """Streams a file through sha256."""
+    digest = hashlib.sha256()
+    with open(path, mode='rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def sync_puns(csv_path=None, force=False):
+    """Syncs the Puns table with puns.csv (row N is pun id N).
+    Skips all work when the file checksum matches the last sync, otherwise
+    applies inserts and updates as bulk statements in one transaction.
+    """
+    csv_path = csv_path or os.path.join('static', 'files', 'puns.csv')
     try:
-        existing_records = Puns.query.first()
-        if existing_records is None:
-            csv_path = os.path.join('static', 'files', 'puns.csv')
-            with open(csv_path, mode='r', encoding='utf-8-sig') as csv_file:
-                csv_reader = csv.DictReader(csv_file)
-                row_count = 0
-                for row in csv_reader:
-                    new_pun = Puns(
-                        question=row['question']
-                        , answer=row['answer']
-                        , blame=row['blame']
-                    )
-                    db.session.add(new_pun)
-                    row_count += 1
-                logging.info(f"Inserted {row_count} rows into Puns.")
-            db.session.commit()
-        else:
-            logging.info("Skipped Insert - table Puns already exists.")
+        checksum = file_checksum(csv_path)
     except FileNotFoundError:
         logging.error(f"CSV file '{csv_path}' not found.")
+        return None
+    state = db.session.get(CatalogState, 'puns')
+    if state is not None and state.checksum == checksum and not force:
+        logging.info("Skipped sync - puns catalog unchanged.")
+        return {'inserted': 0, 'updated': 0}
+    # content hashes of what's stored now
+    stored_hashes = {
+        pun_id: pun_row_hash(question, answer, blame)
+        for pun_id, question, answer, blame
+        in db.session.query(Puns.id, Puns.question, Puns.answer, Puns.blame)
+    }
+    inserts, updates = [], []
+    with open(csv_path, mode='r', encoding='utf-8-sig') as csv_file:
+        csv_reader = csv.DictReader(csv_file)
+        for pun_id, row in enumerate(csv_reader, start=1):
+            values = {
+                'id': pun_id
+                , 'question': row['question']
+                , 'answer': row['answer']
+                , 'blame': row['blame']
+            }
+            stored_hash = stored_hashes.pop(pun_id, None)
+            if stored_hash is None:
+                inserts.append(values)
+            elif stored_hash != pun_row_hash(row['question'], row['answer'], row['blame']):
+                updates.append(values)
+    if stored_hashes:
+        # never delete puns: ratings reference them
+        logging.warning(f"{len(stored_hashes)} puns in the table are no longer in '{csv_path}'.")
+    if inserts:
+        db.session.execute(db.insert(Puns), inserts)
+    if updates:
+        db.session.execute(db.update(Puns), updates)
+    if state is None:
+        db.session.add(CatalogState(name='puns', checksum=checksum))
+    else:
+        state.checksum = checksum
+    db.session.commit()
+    logging.info(f"Synced Puns: inserted {len(inserts)}, updated {len(updates)} rows.")
+    return {'inserted': len(inserts), 'updated': len(updates)}
+
+@bp.cli.command('sync-puns')
+@click.option('--csv-path', default=None, help="Defaults to static/files/puns.csv.")
+@click.option('--force', is_flag=True, help="Diff even if the catalog checksum is unchanged.")
+def sync_puns_command(csv_path, force):
+    """Insert/update Puns from the catalog CSV."""
+    result = sync_puns(csv_path=csv_path, force=force)
+    if result is None:
+        raise click.ClickException("Catalog CSV not found.")
+    click.echo(f"Inserted {result['inserted']}, updated {result['updated']} puns.")
 
 class Ratings(db.Model):
     """Dynamic: filled as users rate puns"""
@@ -105,8 +621,15 @@ class Ratings(db.Model):
     # Foreign Keys
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     pun_id = db.Column(db.Integer, db.ForeignKey('puns.id'), nullable=False)
-    # user rating on a 1-3 scale for a given pun
-    rating = db.Column(db.String, nullable=False)
+    # user rating on the 1-6 panic scale, see rating_codes
+    rating = db.Column(db.SmallInteger, nullable=False)
+    # naive UTC; NULL for ratings stored before timestamps existed
+    created_at = db.Column(db.DateTime, nullable=True, default=lambda: utc_now())
+    __table_args__ = (
+        # supports "latest rating for a user" lookups
+        db.Index('ix_ratings_user_id_id', 'user_id', 'id'),
+        db.CheckConstraint('rating BETWEEN 1 AND 6', name='ck_ratings_rating'),
+    )
 
     def __init__(self, user_id, pun_id, rating):
         self.user_id = user_id
@@ -114,33 +637,1393 @@ class Ratings(db.Model):
         self.rating = rating
 
     def store_ratings(user_id: int, pun_id: int, rating: str):
-        new_rating = Ratings(user_id=user_id, pun_id=pun_id, rating=rating)
-        current_user.ratings.append(new_rating)
+        """Stores a pun_factor_dict key as its code; ValueError if unknown.
+        In write-behind mode the rating is queued for rating_writer instead.
+        """
+        if rating not in rating_codes:
+            raise ValueError(f"Invalid rating: {rating!r}")
+        if RATINGS_WRITE_BEHIND and rating_writer.enqueue(user_id, pun_id, rating):
+            return
+        new_rating = Ratings(user_id=user_id, pun_id=pun_id, rating=rating_codes[rating])
         db.session.add(new_rating)
+        # keep the per-user/per-pun counters and cursor in the same transaction
+        UserRatingCounts.increment(user_id=user_id, rating=rating)
+        PunRatingCounts.increment(pun_id=pun_id, rating=rating)
+        UserProgress.advance(user_id=user_id, pun_id=pun_id)
+        if PUN_ORDERING == 'cf':
+            UserPunQueue.advance(user_id=user_id)
         db.session.commit()
+        ratings_written.inc()
+
+class UserRatingCounts(db.Model):
+    """Dynamic: one row per user, maintained by Ratings.store_ratings()"""
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    # one counter per pun_factor_dict key
+    no = db.Column(db.Integer, nullable=False, default=0)
+    wut = db.Column(db.Integer, nullable=False, default=0)
+    sigh = db.Column(db.Integer, nullable=False, default=0)
+    eyeroll = db.Column(db.Integer, nullable=False, default=0)
+    groan = db.Column(db.Integer, nullable=False, default=0)
+    panic = db.Column(db.Integer, nullable=False, default=0)
+    total = db.Column(db.Integer, nullable=False, default=0)
+
+    def increment(user_id: int, rating: str, count: int = 1):
+        """Adds votes in place; creates the row on a user's first vote."""
+        column = getattr(UserRatingCounts, rating)
+        result = db.session.execute(
+            db.update(UserRatingCounts)
+                .where(UserRatingCounts.user_id == user_id)
+                .values({column: column + count, UserRatingCounts.total: UserRatingCounts.total + count})
+        )
+        if result.rowcount == 0:
+            counts = UserRatingCounts(user_id=user_id, total=count, **{k: 0 for k in pun_factor_dict})
+            setattr(counts, rating, count)
+            db.session.add(counts)
+
+def rebuild_rating_counts():
+    """Recomputes UserRatingCounts from the Ratings table."""
+    vote_counts = db.session.query(
+        Ratings.user_id,
+        Ratings.rating,
+        db.func.count(Ratings.rating)
+    ).group_by(Ratings.user_id, Ratings.rating).all()
+    rows = {}
+    # map codes back to pun_factor_dict keys (column names)
+    rating_names = {code: rating for rating, code in rating_codes.items()}
+    for user_id, code, count in vote_counts:
+        rating = rating_names.get(code)
+        if rating is None:
+            continue
+        row = rows.setdefault(user_id, {'user_id': user_id, 'total': 0, **{k: 0 for k in pun_factor_dict}})
+        row[rating] = count
+        row['total'] += count
+    db.session.execute(db.delete(UserRatingCounts))
+    if rows:
+        db.session.execute(db.insert(UserRatingCounts), list(rows.values()))
+    db.session.commit()
+    logging.info(f"Rebuilt rating counts for {len(rows)} users.")
+    return len(rows)
+
+@bp.cli.command('rebuild-rating-counts')
+def rebuild_rating_counts_command():
+    """Backfill/rebuild per-user rating counters from Ratings."""
+    n_users = rebuild_rating_counts()
+    click.echo(f"Rebuilt rating counts for {n_users} users.")
+
+class PunRatingCounts(db.Model):
+    """Dynamic: one row per rated pun, maintained by Ratings.store_ratings()"""
+    pun_id = db.Column(db.Integer, db.ForeignKey('puns.id'), primary_key=True)
+    # one counter per pun_factor_dict key
+    no = db.Column(db.Integer, nullable=False, default=0)
+    wut = db.Column(db.Integer, nullable=False, default=0)
+    sigh = db.Column(db.Integer, nullable=False, default=0)
+    eyeroll = db.Column(db.Integer, nullable=False, default=0)
+    groan = db.Column(db.Integer, nullable=False, default=0)
+    panic = db.Column(db.Integer, nullable=False, default=0)
+    total = db.Column(db.Integer, nullable=False, default=0)
+    # sum of rating codes, and avg on the 1-6 panic scale for rankings
+    score_sum = db.Column(db.Integer, nullable=False, default=0)
+    avg_rating = db.Column(db.Float, nullable=False, default=0, index=True)
+
+    def increment(pun_id: int, rating: str, count: int = 1):
+        """Adds votes in place; creates the row on a pun's first vote."""
+        column = getattr(PunRatingCounts, rating)
+        score = rating_codes[rating] * count
+        # right-hand sides see the pre-update values
+        result = db.session.execute(
+            db.update(PunRatingCounts)
+                .where(PunRatingCounts.pun_id == pun_id)
+                .values({
+                    column: column + count
+                    , PunRatingCounts.total: PunRatingCounts.total + count
+                    , PunRatingCounts.score_sum: PunRatingCounts.score_sum + score
+                    , PunRatingCounts.avg_rating:
+                        (PunRatingCounts.score_sum + score) * 1.0 / (PunRatingCounts.total + count)
+                })
+        )
+        if result.rowcount == 0:
+            counts = PunRatingCounts(
+                pun_id=pun_id, total=count, score_sum=score, avg_rating=score / count
+                , **{k: 0 for k in pun_factor_dict}
+            )
+            setattr(counts, rating, count)
+            db.session.add(counts)
+
+def rebuild_pun_rating_counts():
+    """Recomputes PunRatingCounts from the Ratings table."""
+    vote_counts = db.session.query(
+        Ratings.pun_id,
+        Ratings.rating,
+        db.func.count(Ratings.rating)
+    ).group_by(Ratings.pun_id, Ratings.rating).all()
+    rating_names = {code: rating for rating, code in rating_codes.items()}
+    rows = {}
+    for pun_id, code, count in vote_counts:
+        rating = rating_names.get(code)
+        if rating is None:
+            continue
+        row = rows.setdefault(pun_id, {
+            'pun_id': pun_id, 'total': 0, 'score_sum': 0, **{k: 0 for k in pun_factor_dict}
+        })
+        row[rating] = count
+        row['total'] += count
+        row['score_sum'] += code * count
+    for row in rows.values():
+        row['avg_rating'] = row['score_sum'] / row['total']
+    db.session.execute(db.delete(PunRatingCounts))
+    if rows:
+        db.session.execute(db.insert(PunRatingCounts), list(rows.values()))
+    db.session.commit()
+    logging.info(f"Rebuilt rating counts for {len(rows)} puns.")
+    return len(rows)
+
+@bp.cli.command('rebuild-pun-rating-counts')
+def rebuild_pun_rating_counts_command():
+    """Backfill/rebuild per-pun rating histograms from Ratings."""
+    n_puns = rebuild_pun_rating_counts()
+    click.echo(f"Rebuilt rating counts for {n_puns} puns.")
+
+def migrate_rating_codes(batch_size: int = 5000):
+    """Online migration of Ratings.rating from strings to integer codes.
+    Copies rows in id batches into ratings_new while the old table stays
+    live, then catches up on new rows and swaps the tables in one short
+    transaction. Resumes from ratings_new if interrupted. Raises ValueError,
+    leaving the old table in place, if any rating can't be mapped to a code.
+    """
+    inspector = db.inspect(db.engine)
+    rating_column = next(c for c in inspector.get_columns('ratings') if c['name'] == 'rating')
+    if isinstance(rating_column['type'], db.Integer):
+        logging.info("Skipped migration - ratings already store integer codes.")
+        return 0
+    # build ratings_new from the model, next to reflected tables it references
+    metadata = db.MetaData()
+    metadata.reflect(bind=db.engine, only=['ratings', 'user', 'puns'])
+    old = metadata.tables['ratings']
+    new = Ratings.__table__.to_metadata(metadata, name='ratings_new')
+    # index names are global in sqlite; indexes are created after the swap
+    new.indexes.clear()
+    new.create(bind=db.engine, checkfirst=True)
+    # rating names, plus codes already written as text ('1'-'6') by
+    # store_ratings() while the old VARCHAR column is still live
+    code_mapping = {**rating_codes, **{str(code): code for code in rating_codes.values()}}
+    code = db.case(code_mapping, value=old.c.rating)
+
+    # keep timestamps if the old table already has them; otherwise copy an
+    # explicit NULL, or from_select() would stamp every historical rating
+    # with the utc_now() default and the rollups would count them as new
+    copied_columns = ['id', 'user_id', 'pun_id', 'rating', 'created_at']
+    selected = [old.c.id, old.c.user_id, old.c.pun_id, code]
+    selected.append(old.c.created_at if 'created_at' in old.c else db.null().label('created_at'))
+
+    def copy_rows(conn, after_id, upto_id=None):
+        query = (
+            db.select(*selected)
+                .where(old.c.id > after_id, old.c.rating.in_(list(code_mapping)))
+        )
+        if upto_id is not None:
+            query = query.where(old.c.id <= upto_id)
+        conn.execute(new.insert().from_select(copied_columns, query))
+
+    with db.engine.connect() as conn:
+        copied_id = conn.scalar(db.select(db.func.max(new.c.id))) or 0
+        max_id = conn.scalar(db.select(db.func.max(old.c.id))) or 0
+    # copy in batches, one short transaction each
+    while copied_id < max_id:
+        upto_id = min(copied_id + batch_size, max_id)
+        with db.engine.begin() as conn:
+            copy_rows(conn, copied_id, upto_id)
+        copied_id = upto_id
+        logging.info(f"Migrated ratings up to id {copied_id} of {max_id}.")
+    # catch up on rows written meanwhile, then swap tables
+    with db.engine.begin() as conn:
+        copy_rows(conn, copied_id)
+        unmapped = conn.scalar(
+            db.select(db.func.count()).select_from(old).where(old.c.rating.not_in(list(code_mapping)))
+        )
+        if unmapped:
+            # rolls back the catch-up; ratings_new is kept for a resume
+            raise ValueError(
+                f"{unmapped} ratings have values that aren't rating names or codes; "
+                "fix or delete them, then rerun the migration."
+            )
+        conn.execute(db.text('ALTER TABLE ratings RENAME TO ratings_old'))
+        conn.execute(db.text('ALTER TABLE ratings_new RENAME TO ratings'))
+        conn.execute(db.text('DROP TABLE ratings_old'))
+        for index in Ratings.__table__.indexes:
+            index.create(bind=conn, checkfirst=True)
+    logging.info("Migrated Ratings.rating to integer codes.")
+    return copied_id
+
+@bp.cli.command('migrate-rating-codes')
+@click.option('--batch-size', default=5000, show_default=True, help="Rows copied per transaction.")
+def migrate_rating_codes_command(batch_size):
+    """Convert string ratings to integer codes in batches."""
+    try:
+        migrate_rating_codes(batch_size=batch_size)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    click.echo("Ratings.rating stores integer codes.")
+
+class UserProgress(db.Model):
+    """Dynamic: each user's position in the puns, maintained by Ratings.store_ratings()"""
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    # pun_id of the user's latest rating (0 before the first one)
+    last_pun_id = db.Column(db.Integer, nullable=False, default=0)
+
+    def advance(user_id: int, pun_id: int):
+        """Moves the user's cursor in place; creates the row if missing."""
+        result = db.session.execute(
+            db.update(UserProgress)
+                .where(UserProgress.user_id == user_id)
+                .values(last_pun_id=pun_id)
+        )
+        if result.rowcount == 0:
+            db.session.add(UserProgress(user_id=user_id, last_pun_id=pun_id))
+
+def rebuild_user_progress():
+    """Recomputes UserProgress from each user's latest Ratings row."""
+    # make sure the composite index exists on databases created before it
+    for index in Ratings.__table__.indexes:
+        index.create(bind=db.engine, checkfirst=True)
+    latest_ids = (
+        db.session.query(db.func.max(Ratings.id))
+            .group_by(Ratings.user_id)
+            .subquery()
+    )
+    latest = (
+        db.session.query(Ratings.user_id, Ratings.pun_id)
+            .filter(Ratings.id.in_(db.select(latest_ids)))
+            .all()
+    )
+    db.session.execute(db.delete(UserProgress))
+    if latest:
+        db.session.execute(
+            db.insert(UserProgress)
+            , [{'user_id': user_id, 'last_pun_id': pun_id} for user_id, pun_id in latest]
+        )
+    db.session.commit()
+    logging.info(f"Rebuilt progress for {len(latest)} users.")
+    return len(latest)
+
+@bp.cli.command('rebuild-user-progress')
+def rebuild_user_progress_command():
+    """Backfill/rebuild per-user progress cursors from Ratings."""
+    n_users = rebuild_user_progress()
+    click.echo(f"Rebuilt progress for {n_users} users.")
+
+class RatingReceipts(db.Model):
+    """Dynamic: (user, pun, client sequence) of ratings posted to the JSON API,
+    so retried batches don't store the same rating twice"""
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    pun_id = db.Column(db.Integer, db.ForeignKey('puns.id'), primary_key=True)
+    seq = db.Column(db.Integer, primary_key=True)
+
+# Write-behind rating ingestion
+# optional: ratings are queued and a background thread group-commits them
+# (ratings, counters and cursors) every RATINGS_FLUSH_MS or RATINGS_FLUSH_ROWS;
+# pending votes and cursors live in the process that queued them, so only
+# one process per instance folder writes behind; the others write ratings
+# synchronously (see RatingWriter.claim)
+RATINGS_WRITE_BEHIND = os.environ.get('RATINGS_WRITE_BEHIND') == '1'
+RATINGS_FLUSH_MS = int(os.environ.get('RATINGS_FLUSH_MS', 200))
+RATINGS_FLUSH_ROWS = int(os.environ.get('RATINGS_FLUSH_ROWS', 500))
+RATINGS_QUEUE_SIZE = int(os.environ.get('RATINGS_QUEUE_SIZE', 10000))
+# failed batches are retried with backoff up to this many seconds apart
+RATINGS_RETRY_MAX_S = float(os.environ.get('RATINGS_RETRY_MAX_S', 30))
+
+def apply_ratings_batch(batch):
+    """Writes (user_id, pun_id, rating) tuples, counters and cursors in one transaction."""
+    db.session.execute(db.insert(Ratings), [
+        {'user_id': user_id, 'pun_id': pun_id, 'rating': rating_codes[rating]}
+        for user_id, pun_id, rating in batch
+    ])
+    vote_counts = {}
+    pun_vote_counts = {}
+    last_pun_ids = {}
+    for user_id, pun_id, rating in batch:
+        vote_counts[(user_id, rating)] = vote_counts.get((user_id, rating), 0) + 1
+        pun_vote_counts[(pun_id, rating)] = pun_vote_counts.get((pun_id, rating), 0) + 1
+        last_pun_ids[user_id] = pun_id
+    for (user_id, rating), count in vote_counts.items():
+        UserRatingCounts.increment(user_id=user_id, rating=rating, count=count)
+    for (pun_id, rating), count in pun_vote_counts.items():
+        PunRatingCounts.increment(pun_id=pun_id, rating=rating, count=count)
+    for user_id, pun_id in last_pun_ids.items():
+        UserProgress.advance(user_id=user_id, pun_id=pun_id)
+    if PUN_ORDERING == 'cf':
+        user_totals = {}
+        for (user_id, _), count in vote_counts.items():
+            user_totals[user_id] = user_totals.get(user_id, 0) + count
+        for user_id, count in user_totals.items():
+            UserPunQueue.advance(user_id=user_id, count=count)
+    db.session.commit()
+    ratings_written.inc(amount=len(batch))
+
+class RatingWriter:
+    """Bounded queue of ratings plus the flusher thread that drains it.
+    Keeps per-user pending votes and cursor so reads see unflushed ratings.
+    A batch that can't be written is retried until it is; batches still
+    failing at shutdown are spilled to a file and replayed on next start.
+    """
+
+    def __init__(self, flush_ms, flush_rows, queue_size, retry_max_s, shutdown_attempts=3):
+        self.flush_interval = flush_ms / 1000
+        self.flush_rows = flush_rows
+        self.retry_max_s = retry_max_s
+        self.shutdown_attempts = shutdown_attempts
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.lock = threading.Lock()
+        self.pending_counts = {}
+        self.pending_pun_ids = {}
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.thread_pid = None
+        # the app whose database the flusher writes to
+        self.app = None
+        self.lock_file = None
+        # the process holding the write-behind lock, if it's this one
+        self.owner_pid = None
+
+    def claim(self, app):
+        """Takes the instance folder's write-behind lock for this process at
+        startup; False if another process holds it. Another process's
+        pending votes would be invisible here, so a process without the
+        lock writes its ratings synchronously instead.
+        """
+        if self.active():
+            return True
+        self.app = app
+        try:
+            import fcntl
+        except ImportError:
+            # no fork() on this platform, so no prefork workers either
+            self.owner_pid = os.getpid()
+            return True
+        os.makedirs(app.instance_path, exist_ok=True)
+        self.lock_file = open(os.path.join(app.instance_path, 'rating-writer.lock'), 'w')
+        try:
+            fcntl.flock(self.lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            self.lock_file.close()
+            self.lock_file = None
+            logging.warning(
+                "RATINGS_WRITE_BEHIND=1 but another process already writes behind "
+                "to this database; this one writes ratings synchronously."
+            )
+            return False
+        self.owner_pid = os.getpid()
+        return True
+
+    def release(self):
+        """Gives the lock up, e.g. in a prefork master that never serves."""
+        if self.lock_file is not None:
+            self.lock_file.close()
+            self.lock_file = None
+        self.owner_pid = None
+
+    def active(self):
+        """True if this process holds the lock and may write behind."""
+        return self.owner_pid == os.getpid()
+
+    def spill_path(self):
+        return os.path.join(self.app.instance_path, 'ratings_spill.jsonl')
+
+    def spill(self, batch, mode='a'):
+        """Appends a batch that couldn't be written to the spill file."""
+        with open(self.spill_path(), mode, encoding='utf-8') as outfile:
+            outfile.writelines(json.dumps(list(item)) + '\n' for item in batch)
+            outfile.flush()
+            os.fsync(outfile.fileno())
+        logging.error(f"Spilled {len(batch)} unwritten ratings to '{self.spill_path()}'.")
+
+    def replay_spill(self):
+        """Writes ratings spilled by an earlier shutdown, then removes the file."""
+        path = self.spill_path()
+        if not os.path.exists(path):
+            return
+        with open(path, encoding='utf-8') as infile:
+            batch = [tuple(json.loads(line)) for line in infile if line.strip()]
+        for start in range(0, len(batch), self.flush_rows):
+            if not self.write(batch[start:start + self.flush_rows]):
+                # stopping; keep only what wasn't written for next time
+                self.spill(batch[start:], mode='w')
+                return
+        os.remove(path)
+        logging.info(f"Replayed {len(batch)} spilled ratings.")
+
+    def start(self):
+        """Starts the flusher once per process (workers may be forked)."""
+        with self.lock:
+            if self.thread is None or self.thread_pid != os.getpid():
+                self.stop_event.clear()
+                self.thread = threading.Thread(target=self.run, name='rating-writer', daemon=True)
+                self.thread.start()
+                self.thread_pid = os.getpid()
+
+    def enqueue(self, user_id, pun_id, rating):
+        """Queues a rating; False when the queue is full or this process
+        doesn't write behind (caller writes it).
+        """
+        if not self.active():
+            return False
+        self.start()
+        with self.lock:
+            try:
+                self.queue.put_nowait((user_id, pun_id, rating))
+            except queue.Full:
+                logging.warning("Rating queue full, writing synchronously.")
+                return False
+            counts = self.pending_counts.setdefault(user_id, {})
+            counts[rating] = counts.get(rating, 0) + 1
+            self.pending_pun_ids[user_id] = pun_id
+        return True
+
+    def pending_votes(self, user_id):
+        """Unflushed votes per rating for a user."""
+        with self.lock:
+            return dict(self.pending_counts.get(user_id, {}))
+
+    def pending_pun_id(self, user_id):
+        """Latest unflushed pun_id for a user, or None."""
+        with self.lock:
+            return self.pending_pun_ids.get(user_id)
+
+    def take_batch(self):
+        """Blocks for the first rating, then collects until time or size is up."""
+        try:
+            batch = [self.queue.get(timeout=self.flush_interval)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.flush_rows:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def write(self, batch, attempts=None):
+        """Writes a batch, backing off between failures; True once written.
+        Gives up after `attempts` tries, or once the writer is stopping.
+        """
+        delay = self.flush_interval
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                with self.app.app_context():
+                    apply_ratings_batch(batch)
+                return True
+            except Exception:
+                logging.exception(f"Failed to write {len(batch)} ratings (attempt {attempt}).")
+            if attempt == attempts or (attempts is None and self.stop_event.is_set()):
+                return False
+            if attempts is None:
+                # the stop event cuts the wait short on shutdown
+                self.stop_event.wait(delay)
+            else:
+                time.sleep(delay)
+            delay = min(delay * 2, self.retry_max_s)
+
+    def settle(self, batch):
+        """Drops a written (or spilled) batch from the pending state."""
+        with self.lock:
+            for user_id, pun_id, rating in batch:
+                counts = self.pending_counts.get(user_id)
+                if counts is None:
+                    # replayed from a spill file, never pending here
+                    continue
+                counts[rating] -= 1
+                if not counts[rating]:
+                    del counts[rating]
+                if not counts:
+                    del self.pending_counts[user_id]
+                    self.pending_pun_ids.pop(user_id, None)
+
+    def run(self):
+        self.replay_spill()
+        while not self.stop_event.is_set():
+            batch = self.take_batch()
+            if batch:
+                if not self.write(batch):
+                    self.spill(batch)
+                self.settle(batch)
+
+    def close(self):
+        """Stops the flusher and writes whatever is still queued."""
+        self.stop_event.set()
+        if self.thread is not None and self.thread_pid == os.getpid():
+            self.thread.join()
+        batch = []
+        while True:
+            try:
+                batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        for start in range(0, len(batch), self.flush_rows):
+            chunk = batch[start:start + self.flush_rows]
+            if not self.write(chunk, attempts=self.shutdown_attempts):
+                self.spill(chunk)
+            self.settle(chunk)
+        if batch:
+            logging.info(f"Flushed {len(batch)} pending ratings on shutdown.")
+
+rating_writer = RatingWriter(RATINGS_FLUSH_MS, RATINGS_FLUSH_ROWS, RATINGS_QUEUE_SIZE, RATINGS_RETRY_MAX_S)
+if RATINGS_WRITE_BEHIND:
+    atexit.register(rating_writer.close)
+
+## Activity Rollups
+
+# site-wide activity per hour and per day, maintained incrementally from
+# new Ratings rows (by id high-water mark) so dashboards never aggregate
+# the whole ratings table
+ROLLUPS_ENABLED = os.environ.get('ROLLUPS_ENABLED') == '1'
+ROLLUP_INTERVAL = float(os.environ.get('ROLLUP_INTERVAL', 60))
+ROLLUP_BATCH_SIZE = int(os.environ.get('ROLLUP_BATCH_SIZE', 10000))
+rollup_buckets = {
+    'hour': lambda dt: dt.replace(minute=0, second=0, microsecond=0)
+    , 'day': lambda dt: dt.replace(hour=0, minute=0, second=0, microsecond=0)
+}
+
+class JobState(db.Model):
+    """Dynamic: high-water marks of background jobs"""
+    name = db.Column(db.String(64), primary_key=True)
+    high_water = db.Column(db.Integer, nullable=False, default=0)
+
+class ActivityRollup(db.Model):
+    """Dynamic: votes per rating class, active users and puns served per bucket"""
+    bucket = db.Column(db.String(8), primary_key=True)  # 'hour' or 'day'
+    bucket_start = db.Column(db.DateTime, primary_key=True)
+    # one counter per pun_factor_dict key
+    no = db.Column(db.Integer, nullable=False, default=0)
+    wut = db.Column(db.Integer, nullable=False, default=0)
+    sigh = db.Column(db.Integer, nullable=False, default=0)
+    eyeroll = db.Column(db.Integer, nullable=False, default=0)
+    groan = db.Column(db.Integer, nullable=False, default=0)
+    panic = db.Column(db.Integer, nullable=False, default=0)
+    total = db.Column(db.Integer, nullable=False, default=0)
+    # distinct users who rated / distinct puns rated in the bucket
+    active_users = db.Column(db.Integer, nullable=False, default=0)
+    puns_served = db.Column(db.Integer, nullable=False, default=0)
+
+class RollupMembers(db.Model):
+    """Dynamic: users and puns already counted in a bucket (for distinct counts)"""
+    bucket = db.Column(db.String(8), primary_key=True)
+    bucket_start = db.Column(db.DateTime, primary_key=True)
+    kind = db.Column(db.String(4), primary_key=True)  # 'user' or 'pun'
+    member_id = db.Column(db.Integer, primary_key=True)
+
+def update_activity_rollups(batch_size: int = ROLLUP_BATCH_SIZE):
+    """Folds Ratings rows past the high-water mark into ActivityRollup.
+    Safe to run from several workers: the high-water mark is claimed with a
+    compare-and-set in the same transaction, so a batch is counted once.
+    Returns the number of ratings processed.
+    """
+    state = db.session.get(JobState, 'activity_rollups')
+    if state is None:
+        state = JobState(name='activity_rollups', high_water=0)
+        db.session.add(state)
+        db.session.commit()
+    high_water = state.high_water
+    rows = db.session.execute(
+        db.select(Ratings.id, Ratings.user_id, Ratings.pun_id, Ratings.rating, Ratings.created_at)
+            .where(Ratings.id > high_water)
+            .order_by(Ratings.id)
+            .limit(batch_size)
+    ).all()
+    if not rows:
+        return 0
+    rating_names = {code: rating for rating, code in rating_codes.items()}
+    # aggregate the batch per bucket
+    buckets = {}
+    for _, user_id, pun_id, code, created_at in rows:
+        # ratings from before timestamps can't be bucketed
+        if created_at is None or code not in rating_names:
+            continue
+        for bucket, truncate in rollup_buckets.items():
+            agg = buckets.setdefault((bucket, truncate(created_at)), {
+                'votes': {}, 'user': set(), 'pun': set()
+            })
+            agg['votes'][rating_names[code]] = agg['votes'].get(rating_names[code], 0) + 1
+            agg['user'].add(user_id)
+            agg['pun'].add(pun_id)
+    for (bucket, bucket_start), agg in buckets.items():
+        # only members not yet seen in this bucket add to the distinct counts
+        new_members = {}
+        for kind in ('user', 'pun'):
+            seen = set(db.session.scalars(
+                db.select(RollupMembers.member_id).where(
+                    RollupMembers.bucket == bucket
+                    , RollupMembers.bucket_start == bucket_start
+                    , RollupMembers.kind == kind
+                    , RollupMembers.member_id.in_(agg[kind])
+                )
+            ))
+            new_members[kind] = agg[kind] - seen
+            if new_members[kind]:
+                db.session.execute(db.insert(RollupMembers), [
+                    {'bucket': bucket, 'bucket_start': bucket_start, 'kind': kind, 'member_id': member_id}
+                    for member_id in new_members[kind]
+                ])
+        rollup = db.session.get(ActivityRollup, (bucket, bucket_start))
+        if rollup is None:
+            rollup = ActivityRollup(
+                bucket=bucket, bucket_start=bucket_start, total=0, active_users=0, puns_served=0
+                , **{k: 0 for k in pun_factor_dict}
+            )
+            db.session.add(rollup)
+        for rating, count in agg['votes'].items():
+            setattr(rollup, rating, getattr(rollup, rating) + count)
+            rollup.total += count
+        rollup.active_users += len(new_members['user'])
+        rollup.puns_served += len(new_members['pun'])
+    # claim the batch; another worker may have processed it meanwhile
+    claimed = db.session.execute(
+        db.update(JobState)
+            .where(JobState.name == 'activity_rollups', JobState.high_water == high_water)
+            .values(high_water=rows[-1][0])
+    )
+    if claimed.rowcount != 1:
+        db.session.rollback()
+        return 0
+    db.session.commit()
+    return len(rows)
+
+def get_activity_rollups(bucket='hour', limit=168):
+    """Latest rollup rows for dashboards, newest first."""
+    return (
+        ActivityRollup.query
+            .filter_by(bucket=bucket)
+            .order_by(ActivityRollup.bucket_start.desc())
+            .limit(limit)
+            .all()
+    )
+
+_rollup_thread_pid = None
+rollup_thread_lock = threading.Lock()
+
+def run_rollup_scheduler(app):
+    """Catches up on rollups every ROLLUP_INTERVAL seconds."""
+    while True:
+        try:
+            with app.app_context():
+                while update_activity_rollups() == ROLLUP_BATCH_SIZE:
+                    pass
+        except Exception:
+            logging.exception("Activity rollup update failed.")
+        time.sleep(ROLLUP_INTERVAL)
+
+@bp.before_app_request
+def start_rollup_scheduler():
+    """Starts the in-process scheduler once per (forked) worker."""
+    global _rollup_thread_pid
+    if not ROLLUPS_ENABLED or _rollup_thread_pid == os.getpid():
+        return
+    with rollup_thread_lock:
+        if _rollup_thread_pid != os.getpid():
+            threading.Thread(
+                target=run_rollup_scheduler, args=(current_app._get_current_object(),)
+                , name='activity-rollups', daemon=True
+            ).start()
+            _rollup_thread_pid = os.getpid()
+
+@bp.cli.command('update-rollups')
+def update_rollups_command():
+    """Fold new ratings into the hourly/daily activity rollups."""
+    total = 0
+    while True:
+        processed = update_activity_rollups()
+        total += processed
+        if processed < ROLLUP_BATCH_SIZE:
+            break
+    click.echo(f"Rolled up {total} ratings.")
+
+@bp.cli.command('migrate-rating-timestamps')
+def migrate_rating_timestamps_command():
+    """Add Ratings.created_at to databases created before it existed."""
+    columns = [c['name'] for c in db.inspect(db.engine).get_columns('ratings')]
+    if 'created_at' in columns:
+        click.echo("Ratings.created_at already exists.")
+        return
+    with db.engine.begin() as conn:
+        conn.execute(db.text('ALTER TABLE ratings ADD COLUMN created_at DATETIME'))
+    click.echo("Added Ratings.created_at; older ratings stay out of the rollups.")
+
+## Pun Ordering
+
+# 'sequential' walks puns by id for everyone; 'cf' serves each user's
+# precomputed queue of unseen puns (see build_pun_queues), falling back
+# to sequential when a user has no queue or has used it up
+PUN_ORDERING = os.environ.get('PUN_ORDERING', 'sequential')
+CF_FACTORS = int(os.environ.get('CF_FACTORS', 16))
+CF_ITERATIONS = int(os.environ.get('CF_ITERATIONS', 10))
+CF_REGULARIZATION = float(os.environ.get('CF_REGULARIZATION', 0.1))
+CF_QUEUE_LENGTH = int(os.environ.get('CF_QUEUE_LENGTH', 200))
+# padded ratings per ALS batch; bounds its (cells, k) temporaries
+CF_CHUNK_NNZ = int(os.environ.get('CF_CHUNK_NNZ', 50000))
+PUN_QUEUE_ITEM = struct.Struct('<I')
+
+class UserPunQueue(db.Model):
+    """Dynamic: per-user order of unseen puns, filled by build_pun_queues()"""
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    # packed little-endian u32 pun ids; head is the next one to serve
+    pun_ids = db.Column(db.LargeBinary, nullable=False)
+    head = db.Column(db.Integer, nullable=False, default=0)
+
+    def advance(user_id: int, count: int = 1):
+        """Pops served puns in place (no-op for users without a queue)."""
+        db.session.execute(
+            db.update(UserPunQueue)
+                .where(UserPunQueue.user_id == user_id)
+                .values(head=UserPunQueue.head + count)
+        )
+
+def get_queued_pun_ids(user_id, n=1):
+    """Next n pun ids from the user's queue, [] when there is none left."""
+    queue_row = db.session.get(UserPunQueue, user_id)
+    if queue_row is None:
+        return []
+    head = queue_row.head
+    # ratings still queued for write-behind have popped their puns already
+    if RATINGS_WRITE_BEHIND:
+        head += sum(rating_writer.pending_votes(user_id).values())
+    size = PUN_QUEUE_ITEM.size
+    packed = queue_row.pun_ids[head * size:(head + n) * size]
+    return [pun_id for (pun_id,) in PUN_QUEUE_ITEM.iter_unpack(packed)]
+
+SparseRatings = namedtuple('SparseRatings', ['shape', 'indptr', 'indices', 'data'])
+
+def build_sparse_ratings(rows, cols, values, shape):
+    """CSR matrix (as numpy arrays) from COO triplets in write order;
+    a later (row, col) duplicate replaces an earlier one.
+    """
+    import numpy as np
+    rows = np.asarray(rows, dtype=np.int64)
+    cols = np.asarray(cols, dtype=np.int64)
+    values = np.asarray(values, dtype=np.float32)
+    # keep the last occurrence of each cell
+    keys = rows * shape[1] + cols
+    _, last = np.unique(keys[::-1], return_index=True)
+    keep = len(keys) - 1 - last
+    rows, cols, values = rows[keep], cols[keep], values[keep]
+    # np.unique sorted keep by key, i.e. by row then col
+    indptr = np.zeros(shape[0] + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=shape[0]), out=indptr[1:])
+    return SparseRatings(shape, indptr, cols.astype(np.int32), values)
+
+def transpose_sparse_ratings(matrix):
+    """CSR of the transpose (i.e. the CSC view of matrix)."""
+    import numpy as np
+    n_rows = matrix.shape[0]
+    rows = np.repeat(np.arange(n_rows, dtype=np.int64), np.diff(matrix.indptr))
+    order = np.lexsort((rows, matrix.indices))
+    indptr = np.zeros(matrix.shape[1] + 1, dtype=np.int64)
+    np.cumsum(np.bincount(matrix.indices, minlength=matrix.shape[1]), out=indptr[1:])
+    return SparseRatings(
+        (matrix.shape[1], n_rows), indptr, rows[order].astype(np.int32), matrix.data[order]
+    )
+
+def als_step(matrix, fixed, regularization, chunk_nnz=CF_CHUNK_NNZ):
+    """Least-squares factors for every row of matrix given the other side's
+    factors. Rows are solved in batches of similar length, each padded to
+    about chunk_nnz cells so the Gram matrices come from one batched matmul.
+    """
+    import numpy as np
+    n_rows, k = matrix.shape[0], fixed.shape[1]
+    factors = np.zeros((n_rows, k), dtype=np.float32)
+    # padding cells gather this zero row
+    padded = np.vstack([fixed, np.zeros((1, k), dtype=fixed.dtype)])
+    eye = np.eye(k, dtype=np.float32)
+    counts = np.diff(matrix.indptr)
+    order = np.argsort(-counts, kind='stable')
+    last = max(len(matrix.indices) - 1, 0)
+    # unrated rows sort last and keep zero factors
+    n_rated = int(np.count_nonzero(counts))
+    start = 0
+    while start < n_rated:
+        width = int(counts[order[start]])
+        rows = order[start:min(start + max(1, chunk_nnz // width), n_rated)]
+        offsets = np.arange(width)
+        valid = offsets < counts[rows][:, None]
+        cells = np.minimum(matrix.indptr[rows][:, None] + offsets, last)
+        gathered = padded[np.where(valid, matrix.indices[cells], len(fixed))]
+        values = np.where(valid, matrix.data[cells], 0).astype(np.float32)
+        transposed = gathered.transpose(0, 2, 1)
+        gram = np.matmul(transposed, gathered)
+        # weighted-lambda regularization
+        gram += regularization * counts[rows][:, None, None] * eye
+        rhs = np.matmul(transposed, values[..., None])
+        factors[rows] = np.linalg.solve(gram, rhs)[..., 0]
+        start += len(rows)
+    return factors
+
+def factorize_ratings(matrix, factors=CF_FACTORS, iterations=CF_ITERATIONS,
+                      regularization=CF_REGULARIZATION, seed=0):
+    """Alternating least squares on mean-centered ratings.
+    Returns (user_factors, pun_factors, mean).
+    """
+    import numpy as np
+    mean = float(matrix.data.mean()) if len(matrix.data) else 0.0
+    centered = matrix._replace(data=matrix.data - mean)
+    transposed = transpose_sparse_ratings(centered)
+    rng = np.random.default_rng(seed)
+    pun_factors = (rng.standard_normal((matrix.shape[1], factors)) * 0.1).astype(np.float32)
+    for _ in range(iterations):
+        user_factors = als_step(centered, pun_factors, regularization)
+        pun_factors = als_step(transposed, user_factors, regularization)
+    return user_factors, pun_factors, mean
+
+def rank_unseen_puns(matrix, user_factors, pun_factors, queue_length=CF_QUEUE_LENGTH, chunk_users=1024):
+    """Yields (row, pun indices best-first) with each row's rated puns excluded."""
+    import numpy as np
+    n_users = matrix.shape[0]
+    queue_length = min(queue_length, matrix.shape[1])
+    for start in range(0, n_users, chunk_users):
+        end = min(start + chunk_users, n_users)
+        scores = user_factors[start:end] @ pun_factors.T
+        lo, hi = matrix.indptr[start], matrix.indptr[end]
+        seen_rows = np.repeat(np.arange(end - start), np.diff(matrix.indptr[start:end + 1]))
+        scores[seen_rows, matrix.indices[lo:hi]] = -np.inf
+        top = np.argpartition(-scores, queue_length - 1, axis=1)[:, :queue_length]
+        top_scores = np.take_along_axis(scores, top, axis=1)
+        order = np.argsort(-top_scores, axis=1)
+        top, top_scores = np.take_along_axis(top, order, axis=1), np.take_along_axis(top_scores, order, axis=1)
+        for i in range(end - start):
+            yield start + i, top[i][np.isfinite(top_scores[i])]
+
+def build_pun_queues(batch_size=1000):
+    """Offline job: factorizes all ratings and replaces UserPunQueue."""
+    import numpy as np
+    n_puns = get_pun_count()
+    user_ids, pun_ids, codes = array('q'), array('q'), array('b')
+    # stream ratings in id order so later ratings win on duplicates
+    for user_id, pun_id, code in db.session.execute(
+        db.select(Ratings.user_id, Ratings.pun_id, Ratings.rating)
+            .order_by(Ratings.id)
+            .execution_options(yield_per=10000)
+    ):
+        if 1 <= pun_id <= n_puns:
+            user_ids.append(user_id)
+            pun_ids.append(pun_id)
+            codes.append(code)
+    if not user_ids:
+        logging.info("Skipped pun queues - no ratings yet.")
+        return 0
+    users, rows = np.unique(np.frombuffer(user_ids, dtype=np.int64), return_inverse=True)
+    cols = np.frombuffer(pun_ids, dtype=np.int64) - 1
+    matrix = build_sparse_ratings(rows, cols, np.frombuffer(codes, dtype=np.int8), (len(users), n_puns))
+    start = time.perf_counter()
+    user_factors, pun_factors, _ = factorize_ratings(matrix)
+    logging.info(f"Factorized {len(matrix.data)} ratings in {time.perf_counter() - start:.1f}s.")
+    db.session.execute(db.delete(UserPunQueue))
+    batch = []
+    for row, ranked in rank_unseen_puns(matrix, user_factors, pun_factors):
+        batch.append({
+            'user_id': int(users[row])
+            , 'pun_ids': (ranked + 1).astype('<u4').tobytes()
+            , 'head': 0
+        })
+        if len(batch) == batch_size:
+            db.session.execute(db.insert(UserPunQueue), batch)
+            batch = []
+    if batch:
+        db.session.execute(db.insert(UserPunQueue), batch)
+    db.session.commit()
+    logging.info(f"Built pun queues for {len(users)} users.")
+    return len(users)
+
+@bp.cli.command('build-pun-queues')
+def build_pun_queues_command():
+    """Precompute per-user pun queues by collaborative filtering."""
+    n_users = build_pun_queues()
+    click.echo(f"Built pun queues for {n_users} users.")
+
+## Pun Catalog
+
+# compiled, read-only copy of curated_puns.txt, mmap'ed so that every
+# worker shares one copy in the page cache; layout:
+#   header: magic, version, flags, count, index offset, sha256 of the rest
+#   records: u16 lengths + utf-8 question, answer, blame, num words hint
+#   index: u32 record offset per pun (pun id N is entry N-1)
+CATALOG_MAGIC = b'PUNS'
+CATALOG_VERSION = 1
+CATALOG_HEADER = struct.Struct('<4sHHII32s')
+CATALOG_RECORD = struct.Struct('<HHHH')
+CATALOG_OFFSET = struct.Struct('<I')
+
+CatalogPun = namedtuple('CatalogPun', ['id', 'question', 'answer', 'blame', 'num_words_msg'])
+
+def get_num_words_msg(answer):
+    """Word count hint shown with the question, e.g. "[3 words]"."""
+    num_words = len(answer.split(" "))
+    if num_words == 1:
+        return f"[{num_words} word]"
+    return f"[{num_words} words]"
+
+def compile_pun_catalog(input_path, output_path):
+    """Streams the pipe-delimited puns file into a binary catalog.
+    Writes to a temp file and renames it, so open catalogs stay valid.
+    """
+    tmp_path = f"{output_path}.tmp"
+    digest = hashlib.sha256()
+    offsets = []
+    with open(input_path, 'r', newline='', encoding='utf-8') as infile, \
+        open(tmp_path, 'wb') as outfile:
+        # placeholder header, rewritten once count and checksum are known
+        outfile.write(b'\0' * CATALOG_HEADER.size)
+        position = CATALOG_HEADER.size
+        for row in csv.reader(infile, delimiter='|'):
+            # same padding as utils/process_puns.py
+            if len(row) < 3:
+                row += [''] * (3 - len(row))
+            question, answer, blame = row[:3]
+            fields = [f.encode('utf-8') for f in (question, answer, blame, get_num_words_msg(answer))]
+            record = CATALOG_RECORD.pack(*(len(f) for f in fields)) + b''.join(fields)
+            offsets.append(position)
+            outfile.write(record)
+            digest.update(record)
+            position += len(record)
+        index = b''.join(CATALOG_OFFSET.pack(offset) for offset in offsets)
+        outfile.write(index)
+        digest.update(index)
+        outfile.seek(0)
+        outfile.write(CATALOG_HEADER.pack(
+            CATALOG_MAGIC, CATALOG_VERSION, 0, len(offsets), position, digest.digest()
+        ))
+    os.replace(tmp_path, output_path)
+    logging.info(f"Compiled {len(offsets)} puns into '{output_path}'.")
+    return len(offsets)
+
+class PunCatalog:
+    """Read-only, mmap-backed lookups of puns by id."""
+
+    def __init__(self, path, verify=True):
+        with open(path, 'rb') as f:
+            self.buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, _, self.count, self.index_offset, checksum = CATALOG_HEADER.unpack_from(self.buf, 0)
+        if magic != CATALOG_MAGIC or version != CATALOG_VERSION:
+            self.close()
+            raise ValueError(f"'{path}' is not a version {CATALOG_VERSION} pun catalog.")
+        if verify and hashlib.sha256(self.buf[CATALOG_HEADER.size:]).digest() != checksum:
+            self.close()
+            raise ValueError(f"Checksum mismatch in pun catalog '{path}'.")
+
+    def __len__(self):
+        return self.count
+
+    def get(self, pun_id):
+        """Returns a CatalogPun, or None if pun_id isn't in the catalog."""
+        if not 1 <= pun_id <= self.count:
+            return None
+        (offset,) = CATALOG_OFFSET.unpack_from(self.buf, self.index_offset + (pun_id - 1) * CATALOG_OFFSET.size)
+        lengths = CATALOG_RECORD.unpack_from(self.buf, offset)
+        position = offset + CATALOG_RECORD.size
+        fields = []
+        for length in lengths:
+            fields.append(self.buf[position:position + length].decode('utf-8'))
+            position += length
+        question, answer, blame, num_words_msg = fields
+        return CatalogPun(pun_id, question, answer, blame, num_words_msg)
+
+    def close(self):
+        self.buf.close()
+
+# opened on first use in each process; False when there is no catalog
+_pun_catalog = None
+
+def get_pun_catalog():
+    """Returns the shared PunCatalog, or None to fall back to the Puns table
+    (also when the catalog's ids don't line up with Puns, so ratings are
+    never stored for puns the table doesn't have).
+    """
+    global _pun_catalog
+    if _pun_catalog is None:
+        path = current_app.config['PUN_CATALOG']
+        try:
+            catalog = PunCatalog(path)
+        except (FileNotFoundError, ValueError) as e:
+            logging.info(f"No pun catalog, using Puns table: {e}")
+            _pun_catalog = False
+            return None
+        try:
+            max_id, rows = db.session.execute(db.select(db.func.max(Puns.id), db.func.count())).one()
+        except OperationalError:
+            # no tables yet
+            db.session.rollback()
+            max_id, rows = None, 0
+        if not (max_id == rows == len(catalog)):
+            catalog.close()
+            logging.warning(
+                f"Pun catalog '{path}' has {len(catalog)} puns, the Puns table {rows} (max id {max_id}); "
+                "using the Puns table. Run sync-puns and compile-puns."
+            )
+            _pun_catalog = False
+            return None
+        _pun_catalog = catalog
+        logging.info(f"Opened pun catalog '{path}' with {len(_pun_catalog)} puns.")
+    return _pun_catalog or None
+
+@bp.cli.command('compile-puns')
+@click.option('--input-path', default=os.path.join('static', 'files', 'curated_puns.txt'), show_default=True)
+@click.option('--output-path', default=os.path.join('static', 'files', 'puns.bin'), show_default=True)
+def compile_puns_command(input_path, output_path):
+    """Compile curated_puns.txt into the binary pun catalog."""
+    count = compile_pun_catalog(input_path, output_path)
+    click.echo(f"Compiled {count} puns into '{output_path}'.")
+
+## TTL Cache
+
+class TTLCache:
+    """In-process LRU with TTL, per worker: the memory pun store, and the
+    identity cache and its revocations."""
+
+    def __init__(self, ttl, max_size=10000):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            item = self.items.get(key)
+            if item is None:
+                return None
+            value, expires_at = item
+            if expires_at < time.monotonic():
+                del self.items[key]
+                return None
+            self.items.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.items[key] = (value, time.monotonic() + self.ttl)
+            self.items.move_to_end(key)
+            while len(self.items) > self.max_size:
+                self.items.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.items.pop(key, None)
+
+## Pun Session Store
+
+# per-user "current pun" state lives server-side under an opaque key, so
+# the signed cookie stays small no matter how long the pun is; a missing
+# entry is harmless since get_next_pun() recomputes it from the cursor.
+# PUN_STORE=memory keeps it in a TTLCache, best with a single process
+class SqlitePunStore:
+    """SQLite file with TTL; shared by every worker on the box."""
+
+    # expired rows are pruned on roughly one in this many writes
+    prune_every = 100
+
+    def __init__(self, path, ttl):
+        self.path = path
+        self.ttl = ttl
+        self.local = threading.local()
+        self.writes = 0
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.connect().execute(
+            'CREATE TABLE IF NOT EXISTS pun_store '
+            '(key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)'
+        )
+
+    def connect(self):
+        """One connection per thread (and per process after a fork)."""
+        conn = getattr(self.local, 'conn', None)
+        if conn is None or self.local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self.local.conn = conn
+            self.local.pid = os.getpid()
+        return conn
+
+    def get(self, key):
+        row = self.connect().execute(
+            'SELECT value FROM pun_store WHERE key = ? AND expires_at >= ?', (key, time.time())
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set(self, key, value):
+        conn = self.connect()
+        conn.execute(
+            'INSERT OR REPLACE INTO pun_store (key, value, expires_at) VALUES (?, ?, ?)'
+            , (key, json.dumps(value), time.time() + self.ttl)
+        )
+        self.writes += 1
+        if self.writes % self.prune_every == 0:
+            conn.execute('DELETE FROM pun_store WHERE expires_at < ?', (time.time(),))
+
+    def delete(self, key):
+        self.connect().execute('DELETE FROM pun_store WHERE key = ?', (key,))
+
+def make_pun_store(config):
+    """Builds the configured store; entries live as long as the session."""
+    kind = config['PUN_STORE']
+    ttl = config['PERMANENT_SESSION_LIFETIME'].total_seconds()
+    if kind == 'sqlite':
+        return SqlitePunStore(config['PUN_STORE_PATH'], ttl=ttl)
+    if kind == 'memory':
+        return TTLCache(ttl=ttl, max_size=config['PUN_STORE_SIZE'])
+    raise ValueError(f"Unknown PUN_STORE '{kind}', expected 'memory' or 'sqlite'.")
+
+def get_pun_store():
+    """The current app's store (see create_app)."""
+    return current_app.extensions['pun_store']
+
+def get_pun_entry():
+    """This session's pun store entry for the current user, or None."""
+    key = session.get('pun_key')
+    if key is None:
+        return None
+    entry = get_pun_store().get(key)
+    if entry is None or entry['user_id'] != current_user.get_id():
+        return None
+    return entry
+
+def set_pun_entry(entry):
+    # keep one key per login so the cookie isn't rewritten for every pun
+    key = session.get('pun_key')
+    if key is None:
+        key = secrets.token_urlsafe(16)
+        session['pun_key'] = key
+    get_pun_store().set(key, {'user_id': current_user.get_id(), **entry})
+
+def get_current_pun():
+    """Current pun dict for this session and user, or None."""
+    entry = get_pun_entry()
+    if entry is None or 'pun_id' not in entry:
+        return None
+    return entry
+
+def set_current_pun(pun_id, question, answer, blame):
+    set_pun_entry({'pun_id': pun_id, 'question': question, 'answer': answer, 'blame': blame})
+
+def set_rated_pun(pun_id, rating):
+    """Replaces the current pun with the one just rated, until the next
+    pun is picked (see get_rated_pun_histogram)."""
+    set_pun_entry({'rated_pun': [pun_id, rating]})
+
+def clear_current_pun(rotate_key=False):
+    key = session.pop('pun_key', None) if rotate_key else session.get('pun_key')
+    if key is not None:
+        get_pun_store().delete(key)
 
 ## Authentication for Signup and Login
 
 # security
 ph = PasswordHasher()
 login_manager = LoginManager()
-login_manager.init_app(app)
-login_manager.login_view = 'login'
+login_manager.login_view = 'main.login'
 
-# functions for hashing and checking passwords
-def hash_password(password):
+# argon2 runs on a small process pool with admission control, so a burst
+# of logins can't pin every request thread on CPU-bound hashing
+HASH_POOL_SIZE = int(os.environ.get('HASH_POOL_SIZE', 2))  # 0 hashes inline
+HASH_QUEUE_LIMIT = int(os.environ.get('HASH_QUEUE_LIMIT', 8))
+HASH_KEY_LIMIT = int(os.environ.get('HASH_KEY_LIMIT', 2))  # per username
+# per client IP, off by default: behind a reverse proxy every client has
+# the proxy's address, so only set it when request.remote_addr is the real
+# client (a direct bind, or ProxyFix) and well above HASH_KEY_LIMIT
+HASH_IP_LIMIT = int(os.environ.get('HASH_IP_LIMIT', 0))
+HASH_TIMEOUT = float(os.environ.get('HASH_TIMEOUT', 10))
+HASH_RETRY_AFTER = int(os.environ.get('HASH_RETRY_AFTER', 2))
+
+class HashingBusy(Exception):
+    """Raised when the hashing queue or a per-username/IP cap is full."""
+
+    def __init__(self, retry_after):
+        super().__init__(f"Password hashing is busy, retry in {retry_after}s.")
+        self.retry_after = retry_after
+
+hash_lock = threading.Lock()
+hash_pending = 0
+hash_pending_by_key = {}
+_hash_pool = None
+_hash_pool_pid = None
+
+def get_hash_pool():
+    """Process pool for argon2, created lazily in each (forked) worker.
+    Its processes come from a forkserver: forking this process directly
+    would copy locks held by the request, log and writer threads. Like
+    any spawned process they re-import __main__, so scripts that hash
+    passwords need an `if __name__ == "__main__":` guard.
+    """
+    global _hash_pool, _hash_pool_pid
+    if HASH_POOL_SIZE <= 0:
+        return None
+    with hash_lock:
+        if _hash_pool is None or _hash_pool_pid != os.getpid():
+            _hash_pool = ProcessPoolExecutor(
+                max_workers=HASH_POOL_SIZE, mp_context=multiprocessing.get_context('forkserver')
+            )
+            _hash_pool_pid = os.getpid()
+        return _hash_pool
+
+def run_hashing(func, *args, keys=()):
+    """Runs func on the hash pool if there's room: at most HASH_QUEUE_LIMIT
+    calls in flight overall and each key's limit, else HashingBusy.
+    """
+    global hash_pending
+    keys = [key for key in keys if key]
+    with hash_lock:
+        if hash_pending >= HASH_QUEUE_LIMIT or any(hash_pending_by_key.get(key, 0) >= hash_key_limit(key) for key in keys):
+            raise HashingBusy(HASH_RETRY_AFTER)
+        hash_pending += 1
+        for key in keys:
+            hash_pending_by_key[key] = hash_pending_by_key.get(key, 0) + 1
+    pool = get_hash_pool()
+    if pool is None:
+        try:
+            return func(*args)
+        finally:
+            release_hashing(keys)
+    try:
+        future = pool.submit(func, *args)
+    except Exception:
+        release_hashing(keys)
+        raise
+    # the slot is held until the job itself is done, not until we stop
+    # waiting, so timed-out jobs still count against the limits
+    future.add_done_callback(lambda _: release_hashing(keys))
+    try:
+        return future.result(timeout=HASH_TIMEOUT)
+    except FuturesTimeoutError:
+        raise HashingBusy(HASH_RETRY_AFTER)
+
+def hash_key_limit(key):
+    """Concurrent hashes allowed for an admission key."""
+    return HASH_IP_LIMIT if key.startswith('ip:') else HASH_KEY_LIMIT
+
+def release_hashing(keys):
+    """Frees the admission slot taken by run_hashing()."""
+    global hash_pending
+    with hash_lock:
+        hash_pending -= 1
+        for key in keys:
+            hash_pending_by_key[key] -= 1
+            if not hash_pending_by_key[key]:
+                del hash_pending_by_key[key]
+
+# run inside the pool's processes
+def _argon2_hash(password):
     return ph.hash(password)
 
-def check_password_hash(hashed_password, plain_password):
+def _argon2_verify(hashed_password, plain_password):
     try:
         return ph.verify(hashed_password, plain_password)
-    except VerifyMismatchError:
+    # imported users have no usable hash (see UNUSABLE_PASSWORD)
+    except (VerifyMismatchError, InvalidHashError):
         return False
 
+# functions for hashing and checking passwords
+def hash_password(password, keys=()):
+    started = time.perf_counter()
+    hashed_password = run_hashing(_argon2_hash, password, keys=keys)
+    argon2_duration.observe(time.perf_counter() - started, ('hash',))
+    return hashed_password
+
+def check_password_hash(hashed_password, plain_password, keys=()):
+    started = time.perf_counter()
+    password_ok = run_hashing(_argon2_verify, hashed_password, plain_password, keys=keys)
+    argon2_duration.observe(time.perf_counter() - started, ('verify',))
+    return password_ok
+
+def get_hashing_keys(username):
+    """Admission keys for a login/signup attempt."""
+    if HASH_IP_LIMIT > 0:
+        return (f"user:{username}", f"ip:{request.remote_addr}")
+    return (f"user:{username}",)
+
+def hashing_busy_response(template, form, error):
+    """503 with a retry hint when password hashing is saturated."""
+    logging.warning(f"Hashing busy for {form.username.data}: {error}")
+    flash(f"Too many login attempts right now. Please retry in {error.retry_after} seconds.", "warning")
+    return render_template(template, form=form), 503, {'Retry-After': str(error.retry_after)}
+
+# Identity cache
+# views only read current_user's id and username, so logged-in requests
+# are served from a per-process LRU with TTL instead of a User query; with
+# IDENTITY_SNAPSHOT=1 the identity also rides in the signed session cookie,
+# so a worker that hasn't seen the user yet skips the query too
+IDENTITY_CACHE_TTL = float(os.environ.get('IDENTITY_CACHE_TTL', 60))
+IDENTITY_CACHE_SIZE = int(os.environ.get('IDENTITY_CACHE_SIZE', 10000))
+IDENTITY_SNAPSHOT = os.environ.get('IDENTITY_SNAPSHOT', '0') == '1'
+
+class Identity(UserMixin):
+    """What a request needs of a logged-in User, without the ORM row."""
+
+    def __init__(self, id, username):
+        self.id = id
+        self.username = username
+
+identity_cache = TTLCache(ttl=IDENTITY_CACHE_TTL, max_size=IDENTITY_CACHE_SIZE)
+# user_id -> time.time() of the last invalidation; snapshots issued before
+# it are refused (kept as long as a snapshot stays valid)
+identity_revocations = TTLCache(ttl=IDENTITY_CACHE_TTL, max_size=IDENTITY_CACHE_SIZE)
+
+def remember_identity(user):
+    """Caches (and optionally snapshots) the identity of a loaded User."""
+    identity = Identity(user.id, user.username)
+    if IDENTITY_CACHE_TTL > 0:
+        identity_cache.set(user.id, identity)
+        if IDENTITY_SNAPSHOT:
+            session['identity'] = [user.id, user.username, time.time()]
+    return identity
+
+def identity_from_snapshot(user_id):
+    """Identity from the session snapshot if it is fresh and not revoked."""
+    snapshot = session.get('identity')
+    if not IDENTITY_SNAPSHOT or not snapshot or snapshot[0] != user_id:
+        return None
+    issued_at = snapshot[2]
+    revoked_at = identity_revocations.get(user_id)
+    if time.time() - issued_at > IDENTITY_CACHE_TTL or (revoked_at is not None and issued_at <= revoked_at):
+        return None
+    return Identity(user_id, snapshot[1])
+
+def invalidate_identity(user_id):
+    """Drops a user's cached identity in this process and refuses older snapshots.
+
+    Other workers' entries expire within IDENTITY_CACHE_TTL.
+    """
+    identity_cache.delete(user_id)
+    identity_revocations.set(user_id, time.time())
+
+# ORM changes only; bulk UPDATE/DELETE statements must call
+# invalidate_identity() themselves
+@event.listens_for(User, 'after_update')
+def user_updated(mapper, connection, target):
+    if db.inspect(target).attrs.password.history.has_changes():
+        invalidate_identity(target.id)
+
+@event.listens_for(User, 'after_delete')
+def user_deleted(mapper, connection, target):
+    invalidate_identity(target.id)
+
 # reload user object from user_id stored in session
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    user_id = int(user_id)
+    if IDENTITY_CACHE_TTL > 0:
+        identity = identity_cache.get(user_id)
+        if identity is not None:
+            identity_lookups.inc(('cache',))
+            return identity
+        identity = identity_from_snapshot(user_id)
+        if identity is not None:
+            identity_lookups.inc(('snapshot',))
+            identity_cache.set(user_id, identity)
+            return identity
+    identity_lookups.inc(('database',))
+    user = db.session.get(User, user_id)
+    if user is None:
+        return None
+    return remember_identity(user)
 
 class RegisterForm(FlaskForm):
     username = StringField(
@@ -189,15 +2072,112 @@ class LoginForm(FlaskForm):
     submit = SubmitField("Login")
 
 
+## Static Assets
+
+# fingerprinted copies never change, so browsers may cache them for a year
+ASSET_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+# not known to every platform's mimetypes table
+mimetypes.add_type('image/webp', '.webp')
+mimetypes.add_type('image/avif', '.avif')
+_asset_manifest = None
+
+def get_asset_manifest():
+    """{'css/styles.css': 'css/styles.<hash>.css', ...}; empty before a build."""
+    global _asset_manifest
+    if _asset_manifest is None:
+        try:
+            with open(current_app.config['ASSET_MANIFEST'], encoding='utf-8') as manifest_file:
+                _asset_manifest = json.load(manifest_file)
+        except FileNotFoundError:
+            logging.info("No asset manifest, serving assets from /static.")
+            _asset_manifest = {}
+    return _asset_manifest
+
+@bp.app_template_global()
+def asset_url(filename, cdn=None):
+    """url_for('static', ...) that prefers the fingerprinted build; vendored
+    files fall back to their cdn url until utils/build_assets.py --vendor runs.
+    """
+    hashed_filename = get_asset_manifest().get(filename)
+    if hashed_filename is not None:
+        return url_for('main.assets', filename=hashed_filename)
+    if cdn is not None and not os.path.isfile(os.path.join(current_app.static_folder, filename)):
+        return cdn
+    return url_for('static', filename=filename)
+
+_media_report = None
+
+def get_media_report():
+    """{'img/dragon.gif': {'bytes': ..., 'variants': {'webp': {...}}}, ...}"""
+    global _media_report
+    if _media_report is None:
+        try:
+            with open(current_app.config['MEDIA_REPORT'], encoding='utf-8') as report_file:
+                _media_report = json.load(report_file)
+        except FileNotFoundError:
+            _media_report = {}
+    return _media_report
+
+@bp.app_template_global()
+def picture(filename, alt='', **attrs):
+    """<picture> with AVIF/WebP sources when transcoded, the original as fallback."""
+    variants = get_media_report().get(filename, {}).get('variants', {})
+    sources = ''.join(
+        f'<source type="image/{ext}" srcset="{asset_url(variants[ext]["path"])}">'
+        for ext in ('avif', 'webp') if ext in variants
+    )
+    img_attrs = ''.join(f' {name}="{escape(value)}"' for name, value in attrs.items())
+    return Markup(
+        f'<picture>{sources}<img src="{asset_url(filename)}" alt="{escape(alt)}"{img_attrs}></picture>'
+    )
+
+# Fragment cache
+# per-pun fragments only depend on the pun's text, so the text is the key
+FRAGMENT_CACHE_SIZE = int(os.environ.get('FRAGMENT_CACHE_SIZE', 2048))
+fragment_cache = OrderedDict()
+fragment_cache_lock = threading.Lock()
+
+def render_fragment(template_name, **context):
+    """Renders a partial template once per distinct context (LRU cached)."""
+    key = (template_name, tuple(sorted(context.items())))
+    with fragment_cache_lock:
+        html = fragment_cache.get(key)
+        if html is not None:
+            fragment_cache.move_to_end(key)
+            return html
+    html = Markup(render_template(template_name, **context))
+    with fragment_cache_lock:
+        fragment_cache[key] = html
+        while len(fragment_cache) > FRAGMENT_CACHE_SIZE:
+            fragment_cache.popitem(last=False)
+    return html
+
+@bp.route('/assets/<path:filename>')
+def assets(filename):
+    """Fingerprinted assets, precompressed when the client accepts it."""
+    dist_dir = os.path.join(current_app.static_folder, 'dist')
+    mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    for encoding, suffix in (('br', '.br'), ('gzip', '.gz')):
+        compressed_path = safe_join(dist_dir, filename + suffix)
+        if request.accept_encodings[encoding] and compressed_path and os.path.isfile(compressed_path):
+            response = send_from_directory(dist_dir, filename + suffix, mimetype=mimetype)
+            response.headers['Content-Encoding'] = encoding
+            break
+    else:
+        response = send_from_directory(dist_dir, filename, mimetype=mimetype)
+    response.headers['Cache-Control'] = ASSET_CACHE_CONTROL
+    response.vary.add('Accept-Encoding')
+    return response
+
 ## Define Routes
 
 # Home
-@app.route('/')
+@bp.route('/')
 def home():
     return render_template('index.html')
 
 # Signup
-@app.route("/signup", methods=["POST", "GET"])
+@bp.route("/signup", methods=["POST", "GET"])
 def signup():
     form = RegisterForm()
     if request.method == "POST":
@@ -215,14 +2195,20 @@ def signup():
                 flash(f"Username '{form.username.data}' is not valid. Are you an approved beta user?", "warning")
                 return render_template("signup.html", form=form)
             else:
-                hashed_password = hash_password(form.password.data)
+                try:
+                    hashed_password = hash_password(
+                        form.password.data
+                        , keys=get_hashing_keys(form.username.data)
+                    )
+                except HashingBusy as e:
+                    return hashing_busy_response('signup.html', form, e)
                 new_user = User(username=form.username.data, password=hashed_password)
                 db.session.add(new_user)
                 db.session.commit()
                 msg = f"Created new account for {form.username.data}. Please login."
                 logging.info(msg=msg)
                 flash(msg, "info")
-                return redirect(url_for('login'))
+                return redirect(url_for('main.login'))
         else:
             for field, errors in form.errors.items():
                 for error in errors:
@@ -233,55 +2219,75 @@ def signup():
             msg = f"You're currently logged in as {current_user.username}. \
                 Please log out before signing up with another username."
             flash(msg, "info")
-            return redirect(url_for('play'))
+            return redirect(url_for('main.play'))
         # throws error when current_user is Anonymous (not logged in)
         except AttributeError:
             return render_template('signup.html', form=form)
 
 # Login
-@app.route("/login", methods=["POST", "GET"])
+@bp.route("/login", methods=["POST", "GET"])
 def login():
     form = LoginForm()
     if request.method == "POST":
         if form.validate_on_submit():
             user_id = User.query.filter_by(username=form.username.data).first()
             if user_id:
-                if check_password_hash(user_id.password, form.password.data):
+                try:
+                    password_ok = check_password_hash(
+                        user_id.password
+                        , form.password.data
+                        , keys=get_hashing_keys(form.username.data)
+                    )
+                except HashingBusy as e:
+                    return hashing_busy_response('login.html', form, e)
+                if password_ok:
                     # clear any session variables related to question and answer
-                    session.pop('pun_id', None)
-                    session.pop('question', None)
-                    session.pop('answer', None)
+                    clear_current_pun(rotate_key=True)
                     login_user(user_id)
+                    remember_identity(user_id)
                     flash(f"Hello {user_id.username}, you are logged in.", "info")
-                    return redirect(url_for('play'))
+                    return redirect(url_for('main.play'))
                 else:
                     logging.info(msg=f"Wrong password for {form.username.data}.")
                     flash("Wrong password.", "info")
                     return render_template('login.html', form=form)
             else:
                 flash("Did you signup for an account yet?", "info")
-                return redirect(url_for('signup'))
+                return redirect(url_for('main.signup'))
     else:
         # cannot do "if current_user" since it exists, yet has no username
         try:
             msg = f"{current_user.username}, you're already logged in."
             flash(msg, "info")
-            return redirect(url_for('play'))
+            return redirect(url_for('main.play'))
         # throws error when current_user = AnonymousUserMixin
         except AttributeError:
             return render_template('login.html', form=form)
 
 # Logout
-@app.route('/logout', methods=["POST", "GET"])
+@bp.route('/logout', methods=["POST", "GET"])
 @login_required
 def logout():
     logout_user()
+    session.pop('identity', None)
     flash("You've logged out.", "info")
-    return redirect(url_for('login'))
+    return redirect(url_for('main.login'))
 
 # Helper funcs for Play
 def get_user_latest_pun_id():
     """Helper function for get_next_pun()"""
+    # ratings still queued for write-behind are the most recent
+    if RATINGS_WRITE_BEHIND:
+        pending_pun_id = rating_writer.pending_pun_id(current_user.id)
+        if pending_pun_id is not None:
+            return pending_pun_id
+    # primary-key read of the user's cursor
+    progress = db.session.get(UserProgress, current_user.id)
+    if progress:
+        last_pun_id = progress.last_pun_id
+        logging.info("User %s - lastest pun id %s", current_user, last_pun_id)
+        return last_pun_id
+    # fallback for users without a cursor yet (uses ix_ratings_user_id_id)
     last_play = (
         db.session.query(Ratings)
             .filter_by(user_id=current_user.id)
@@ -290,48 +2296,61 @@ def get_user_latest_pun_id():
     )
     if last_play:
         last_pun_id = last_play.pun_id
-        logging.info(f"User {current_user} - lastest pun id {last_pun_id}")
+        logging.info("User %s - lastest pun id %s", current_user, last_pun_id)
     else:
-        logging.info(f"No answers found for user: {current_user}.")
+        logging.info("No answers found for user: %s.", current_user)
         last_pun_id = 0
+    # store the cursor so later requests skip this query
+    db.session.add(UserProgress(user_id=current_user.id, last_pun_id=last_pun_id))
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # a concurrent request for this user stored the cursor first
+        db.session.rollback()
+        return db.session.get(UserProgress, current_user.id).last_pun_id
     # return last pun_id
     return last_pun_id
 
+def lookup_pun(pun_id):
+    """Pun by id from the mmap'ed catalog when present, else from Puns."""
+    catalog = get_pun_catalog()
+    if catalog is not None:
+        return catalog.get(pun_id)
+    return db.session.get(Puns, pun_id)
+
 def get_next_pun():
     """Gets the next pun."""
-    if 'pun_id' not in session:
+    current_pun = get_current_pun()
+    if current_pun is None:
         # get users' latest pun_id
         # 0 if user hasn't answered yet
         if current_user.is_authenticated:
             latest_pun_id = get_user_latest_pun_id()
         else:
             latest_pun_id = 0
-        # get next pun
-        next_pun_id = latest_pun_id + 1
-        logging.info(f"Next pun id: {next_pun_id}")
-        # use filter query to get the pun row
-        pun = Puns.query.filter_by(id=next_pun_id).first()
+        # get next pun: head of the user's queue, else the next id
+        queued = get_queued_pun_ids(current_user.id) if PUN_ORDERING == 'cf' and current_user.is_authenticated else []
+        next_pun_id = queued[0] if queued else latest_pun_id + 1
+        logging.info("Next pun id: %s", next_pun_id)
+        # get the pun from the shared catalog, else from the puns table
+        pun = lookup_pun(next_pun_id)
         # 'None' when next pun_id isn't in the puns table
         if pun is None:
-            logging.info(f"User {current_user} answered all puns.")
+            logging.info("User %s answered all puns.", current_user)
             # No more puns for the user, start back at first pun
-            pun = Puns.query.filter_by(id=1).first()
+            pun = lookup_pun(1)
         # get pun id, question, answer from pun object
         pun_id = pun.id
         question = f"{pun.question}?"
         answer = pun.answer
         blame = pun.blame
         # persist for single answer
-        session['pun_id'] = pun_id
-        session['question'] = question
-        session['answer'] = answer
-        session['blame'] = blame
-        #logging.info(f"{session}")
+        set_current_pun(pun_id, question, answer, blame)
     else:
-        pun_id = session['pun_id']
-        question = session['question']
-        answer = session['answer']
-        blame = session['blame']
+        pun_id = current_pun['pun_id']
+        question = current_pun['question']
+        answer = current_pun['answer']
+        blame = current_pun['blame']
     return pun_id, question, answer, blame
 
 pun_factor_dict = {
@@ -343,6 +2362,9 @@ pun_factor_dict = {
     'panic': '\U0001FAE8'
 }
 
+# compact codes stored in Ratings.rating, in panic scale order (1-6)
+rating_codes = {rating: code for code, rating in enumerate(pun_factor_dict, start=1)}
+
 animal_dict = {
     'dragon': [32, 50, 68, 88, 103, 132, 152, 176, 200, 232, 250, 268, 288]
     , 'unicorn': [17, 35, 56, 75, 95, 116, 135, 147, 158, 175, 195, 217, 235, 256, 275, 295]
@@ -363,39 +2385,47 @@ def get_confetti_go_list(tot_votes, animal_dict):
         go_list.append(animal_go)
     return go_list
 
+def get_confetti_animals(tot_votes):
+    """Names of the animals to throw at tot_votes, e.g. ['owl']."""
+    go_list = get_confetti_go_list(tot_votes=tot_votes, animal_dict=animal_dict)
+    return [animal for animal, go in zip(animal_dict.keys(), go_list) if go]
+
 def query_voting_stats():
-    # query Ratings and count user selections
-    vote_counts = db.session.query(
-        Ratings.user_id,
-        Ratings.rating,
-        db.func.count(Ratings.rating)
-    ).filter_by(user_id=current_user.id).group_by(Ratings.user_id, Ratings.rating).all()
-    # create a dictionary to hold the counts
-    vote_count_dict = {rating: count for _, rating, count in vote_counts}
+    # primary-key read of the user's counters (no rows yet if user hasn't voted)
+    counts = db.session.get(UserRatingCounts, current_user.id)
     # list panic scale and ratings array
     panic_scale = list(pun_factor_dict.keys())
-    panic_scale_rating = np.array([1, 2, 3, 4, 5, 6])
+    panic_scale_rating = [rating_codes[deg] for deg in panic_scale]
     # create a votes_list by mapping the actual counts to the possible ratings
     # default to 0 if not mapped
-    votes_list = [vote_count_dict.get(deg, 0) for deg in panic_scale]
+    votes_list = [getattr(counts, deg) if counts else 0 for deg in panic_scale]
+    # add the user's votes still queued for write-behind
+    if RATINGS_WRITE_BEHIND:
+        pending = rating_writer.pending_votes(current_user.id)
+        votes_list = [votes + pending.get(deg, 0) for deg, votes in zip(panic_scale, votes_list)]
     # combine the panic scale and votes_list into data to be passed to view_answer
     data = list(zip(panic_scale, votes_list, panic_scale_rating))
     return data
 
 # Play
-@app.route('/play', methods=["POST", "GET"])
+@bp.route('/play', methods=["POST", "GET"])
 @login_required
 def play():
     """Delivers pun question.
-    Uses get_next_pun(), which checks for session data.
-    Session pun data is cleared when either:
+    Uses get_next_pun(), which checks the pun store (see get_current_pun).
+    Current pun data is cleared when either:
         1. Users login, or
-        2. Users answer a question ("POST" method below)
+        2. Users answer a question ("POST" method below), which leaves the
+           rated pun in its place for the next page
     """
     if request.method == "POST":
         # get rating
         rating = request.form.get("feedback")
-        logging.info(f"Received rating: {rating}")
+        logging.info("Received rating: %s", rating)
+        # reject anything that isn't one of the emoji buttons
+        if rating not in rating_codes:
+            flash("Please rate the pun with one of the emoji buttons.", "warning")
+            return redirect(url_for('main.play'))
         # get current session data
         pun_id, question, answer, _ = get_next_pun()
         user_id = current_user.id
@@ -405,90 +2435,287 @@ def play():
             , pun_id=pun_id
             , rating=rating
         )
-        # clear session pun data
-        session.pop('pun_id', None)
-        session.pop('question', None)
-        session.pop('answer', None)
-        session.pop('blame', None)
+        # replace the current pun with the rated one: the next question
+        # shows how everyone rated it
+        set_rated_pun(pun_id, rating)
         # reload page for GET method
-        return redirect(url_for('play'))
+        return redirect(url_for('main.play'))
     else:
+        # read before get_next_pun() replaces the entry holding it
+        community = get_rated_pun_histogram()
         # GET: get next pun question and answer
-        _, question, answer, blame = get_next_pun()
-        num_words = len(answer.split(" "))
-        if num_words == 1:
-            num_words_msg = f"[{num_words} word]"
-        else:
-            num_words_msg = f"[{num_words} words]"
+        pun_id, question, answer, blame = get_next_pun()
+        # precomputed in the catalog
+        catalog = get_pun_catalog()
+        catalog_pun = catalog.get(pun_id) if catalog is not None else None
+        num_words_msg = catalog_pun.num_words_msg if catalog_pun else get_num_words_msg(answer)
         # query voting stats
         data = query_voting_stats()
         # unpack votest list
         votes_list = [item[1] for item in data]
         # sum votes
-        tot_votes = np.sum(votes_list)
-        # get go nogo for each animal
-        go_list = get_confetti_go_list(tot_votes=tot_votes, animal_dict=animal_dict)
-        drag_go, unic_go, owls_go, zebr_go, lady_go, jell_go = go_list
-        # return play
+        tot_votes = sum(votes_list)
+        # return play; static/js/play.js throws the confetti
         return render_template(
             'play.html'
-            , values=[question, num_words_msg]
-            , dragons_go=drag_go
-            , unicorns_go=unic_go
-            , owls_go=owls_go
-            , zebras_go=zebr_go
-            , ladybugs_go=lady_go
-            , jellyfishes_go=jell_go
+            , pun_html=render_fragment('_play_pun.html', question=question, num_words_msg=num_words_msg)
+            , confetti_animals=get_confetti_animals(tot_votes)
+            , community=community
         )
 
+def get_pun_histogram(pun_id, pending_rating=None):
+    """Everyone's ratings of a pun from one primary-key read:
+    (total, [(rating, emoji, count, pct), ...]), or None before the first vote.
+    pending_rating adds the user's own vote while it is still queued.
+    """
+    counts = db.session.get(PunRatingCounts, pun_id)
+    votes = {rating: getattr(counts, rating) if counts is not None else 0 for rating in pun_factor_dict}
+    if pending_rating in votes:
+        votes[pending_rating] += 1
+    total = sum(votes.values())
+    if not total:
+        return None
+    histogram = [
+        (rating, emoji, votes[rating], round(100 * votes[rating] / total))
+        for rating, emoji in pun_factor_dict.items()
+    ]
+    return total, histogram
+
+def get_rated_pun_histogram():
+    """Histogram of the pun the user just rated (once, after the rating POST),
+    so nobody sees how others voted before voting themselves."""
+    entry = get_pun_entry()
+    if entry is None or 'rated_pun' not in entry:
+        return None
+    pun_id, rating = entry['rated_pun']
+    pending = RATINGS_WRITE_BEHIND and rating_writer.pending_pun_id(current_user.id) == pun_id
+    return get_pun_histogram(pun_id, pending_rating=rating if pending else None)
+
 # View Answer
-@app.route('/view_answer', methods=["POST", "GET"])
+@bp.route('/view_answer', methods=["POST", "GET"])
 @login_required
 def view_answer():
     """Delivers pun answer and results.
-    Uses get_next_pun(), which checks for session data.
+    Uses get_next_pun(), which checks the pun store (see get_current_pun).
     """
     if request.method == "POST":
         # get session data
-        _, question, answer, blame = get_next_pun()
+        pun_id, question, answer, blame = get_next_pun()
         if blame:
             blame = f"~ blame {blame}"
-        values = [question, answer, blame]
         # return view answer
         return render_template(
             'view_answer.html'
-            , values=values
+            , pun_html=render_fragment('_view_answer_pun.html', question=question, answer=answer, blame=blame)
             , pun_factor_dict=pun_factor_dict
         )
     else:
-        return redirect(url_for('play'))
+        return redirect(url_for('main.play'))
 
-# Stats
-@app.route('/stats', methods=["GET"])
+# JSON API
+# lets clients prefetch puns and post ratings in batches instead of the
+# GET play -> POST view_answer -> POST play -> redirect round trips
+API_MAX_PUNS = 50
+
+def get_pun_count():
+    """Number of puns; ids run 1..count (see sync_puns)."""
+    catalog = get_pun_catalog()
+    if catalog is not None:
+        return len(catalog)
+    return db.session.query(db.func.max(Puns.id)).scalar() or 0
+
+def lookup_puns(pun_ids):
+    """Puns by id in the given order, from the catalog or one IN query."""
+    catalog = get_pun_catalog()
+    if catalog is not None:
+        return [catalog.get(pun_id) for pun_id in pun_ids]
+    puns = {pun.id: pun for pun in Puns.query.filter(Puns.id.in_(set(pun_ids)))}
+    return [puns.get(pun_id) for pun_id in pun_ids]
+
+@bp.route('/api/puns', methods=["GET"])
 @login_required
-def stats():
-    """Display user-level stats (for now)."""
-    # query voting stats
-    data = query_voting_stats()
+def api_puns():
+    """Next n puns from the user's cursor (wrapping around like /play),
+    each with the confetti that /play would throw when showing it.
+    """
+    n = min(max(request.args.get('n', 10, type=int), 1), API_MAX_PUNS)
+    pun_count = get_pun_count()
+    if not pun_count:
+        return jsonify(puns=[], csrf_token=generate_csrf())
+    pun_ids = get_queued_pun_ids(current_user.id, n) if PUN_ORDERING == 'cf' else []
+    if not pun_ids:
+        latest_pun_id = get_user_latest_pun_id()
+        pun_ids = [(latest_pun_id + k) % pun_count + 1 for k in range(n)]
+    tot_votes = sum(item[1] for item in query_voting_stats())
+    puns = []
+    for k, pun in enumerate(lookup_puns(pun_ids)):
+        if pun is None:
+            continue
+        puns.append({
+            'id': pun.id
+            , 'question': f"{pun.question}?"
+            , 'answer': pun.answer
+            , 'blame': pun.blame
+            , 'num_words_msg': getattr(pun, 'num_words_msg', None) or get_num_words_msg(pun.answer)
+            # each rating before this pun adds one vote
+            , 'confetti': get_confetti_animals(tot_votes + k)
+        })
+    # the token goes back in the X-CSRFToken header of POST /api/ratings
+    return jsonify(puns=puns, csrf_token=generate_csrf())
+
+def store_api_ratings(user_id, batch):
+    """Stores the {(pun_id, seq): rating} entries that have no receipt yet
+    and returns them as (user_id, pun_id, rating). IntegrityError (after a
+    rollback, nothing stored) if a concurrent request stored one first.
+    """
+    # skip what an earlier (retried) request already stored
+    seen = {
+        (receipt.pun_id, receipt.seq)
+        for receipt in RatingReceipts.query.filter(
+            RatingReceipts.user_id == user_id
+            , RatingReceipts.seq.in_({seq for _, seq in batch})
+        )
+    }
+    new_ratings = []
+    for (pun_id, seq), rating in batch.items():
+        if (pun_id, seq) in seen:
+            continue
+        db.session.add(RatingReceipts(user_id=user_id, pun_id=pun_id, seq=seq))
+        new_ratings.append((user_id, pun_id, rating))
+    try:
+        if RATINGS_WRITE_BEHIND:
+            db.session.commit()
+        elif new_ratings:
+            # receipts, ratings, counters and cursor in one transaction
+            apply_ratings_batch(new_ratings)
+    except IntegrityError:
+        db.session.rollback()
+        raise
+    if RATINGS_WRITE_BEHIND:
+        for _, pun_id, rating in new_ratings:
+            Ratings.store_ratings(user_id=user_id, pun_id=pun_id, rating=rating)
+    return new_ratings
+
+@bp.route('/api/ratings', methods=["POST"])
+@login_required
+def api_ratings():
+    """Stores a batch of {"pun_id", "rating", "seq"} ratings, in order.
+    Idempotent per user/pun/seq: resubmitted entries are skipped.
+    """
+    payload = request.get_json(silent=True) or {}
+    entries = payload.get('ratings')
+    if not isinstance(entries, list):
+        return jsonify(error="Expected {\"ratings\": [...]}."), 400
+    pun_count = get_pun_count()
+    batch = {}
+    for entry in entries:
+        try:
+            pun_id, rating, seq = int(entry['pun_id']), entry['rating'], int(entry['seq'])
+        except (TypeError, KeyError, ValueError):
+            return jsonify(error=f"Invalid entry: {entry!r}"), 400
+        if rating not in rating_codes or not 1 <= pun_id <= pun_count:
+            return jsonify(error=f"Invalid entry: {entry!r}"), 400
+        batch.setdefault((pun_id, seq), rating)
+    user_id = current_user.id
+    # a retry that races the original request collides on a receipt: it
+    # rolls back and re-reads the receipts the original committed
+    for _ in range(3):
+        try:
+            new_ratings = store_api_ratings(user_id, batch)
+            break
+        except IntegrityError:
+            logging.info("User %s - API ratings raced a concurrent request, retrying", current_user)
+    else:
+        return jsonify(error="Conflicting concurrent requests, retry."), 409
+    logging.info("User %s - stored %s of %s API ratings", current_user, len(new_ratings), len(entries))
+    # the cursor moved; /play must not show a stale current pun
+    if new_ratings:
+        clear_current_pun()
+    return '', 204
 
+@bp.route('/api/activity', methods=["GET"])
+@login_required
+def api_activity():
+    """Site-wide activity from the rollups: ?bucket=hour|day&limit=N"""
+    bucket = request.args.get('bucket', 'hour')
+    if bucket not in rollup_buckets:
+        return jsonify(error="bucket must be 'hour' or 'day'."), 400
+    limit = min(max(request.args.get('limit', 168, type=int), 1), 1000)
+    rows = get_activity_rollups(bucket=bucket, limit=limit)
+    return jsonify(bucket=bucket, rollups=[
+        {
+            'bucket_start': row.bucket_start.isoformat()
+            , 'votes': {rating: getattr(row, rating) for rating in pun_factor_dict}
+            , 'total': row.total
+            , 'active_users': row.active_users
+            , 'puns_served': row.puns_served
+        }
+        for row in rows
+    ])
+
+@bp.route('/api/puns/ranking', methods=["GET"])
+@login_required
+def api_pun_ranking():
+    """Top (or ?order=bottom) puns by average rating, read off the
+    avg_rating index: ?limit=N&min_votes=M
+    """
+    order = request.args.get('order', 'top')
+    if order not in ('top', 'bottom'):
+        return jsonify(error="order must be 'top' or 'bottom'."), 400
+    limit = min(max(request.args.get('limit', 10, type=int), 1), 100)
+    min_votes = max(request.args.get('min_votes', 1, type=int), 1)
+    sort = PunRatingCounts.avg_rating.desc() if order == 'top' else PunRatingCounts.avg_rating.asc()
+    rows = (
+        PunRatingCounts.query
+            .filter(PunRatingCounts.total >= min_votes)
+            .order_by(sort)
+            .limit(limit)
+            .all()
+    )
+    puns = lookup_puns([row.pun_id for row in rows])
+    return jsonify(order=order, puns=[
+        {
+            'id': row.pun_id
+            , 'question': f"{pun.question}?" if pun else None
+            , 'avg_rating': round(row.avg_rating, 2)
+            , 'total': row.total
+            , 'votes': {rating: getattr(row, rating) for rating in pun_factor_dict}
+        }
+        for row, pun in zip(rows, puns)
+    ])
+
+# Stats chart cache
+# charts are fully determined by the user's six vote counts, so the counts
+# themselves are the cache key and the source of a strong ETag
+CHART_VERSION = 1
+CHART_CACHE_SIZE = int(os.environ.get('CHART_CACHE_SIZE', 256))
+chart_cache = OrderedDict()
+chart_cache_lock = threading.Lock()
+
+def get_chart_etag(votes_key):
+    """Strong ETag derived from the vote counts (and chart version)."""
+    key_str = f"{CHART_VERSION}:{','.join(str(v) for v in votes_key)}"
+    return hashlib.sha1(key_str.encode('utf-8')).hexdigest()
+
+def render_stats_chart(data):
+    """Renders the user's ratings bar plot as PNG bytes."""
     # extract data for the plot
     scales = [item[0] for item in data]
     votes = [item[1] for item in data]
     rating_scale = [item[2] for item in data]
 
     # get total votes
-    tot_votes = np.sum(votes)
+    tot_votes = sum(votes)
 
     # calculate avg rating across votes
-    ratings_array = rating_scale * np.array(votes)
-    avg_rating = np.sum(ratings_array) / tot_votes
+    ratings_sum = sum(r * v for r, v in zip(rating_scale, votes))
+    avg_rating = ratings_sum / tot_votes if tot_votes else 0
 
-    # ensure 0 instead of nan for first calculation
-    if np.isnan(avg_rating):
-       avg_rating = 0
+    Figure, MaxNLocator = load_plotting()
 
     # create a simple bar plot with custom size and background color
-    fig, ax = plt.subplots(figsize=(12, 6))
+    fig = Figure(figsize=(12, 6))
+    ax = fig.subplots()
     fig.patch.set_facecolor('#4e505b')
     ax.set_facecolor('#4e505b')
 
@@ -510,28 +2737,458 @@ def stats():
     ax.axvline(avg_rating_x, color='#b34a4a', linestyle='--', linewidth=3, label=f'Avg rating: {avg_rating:.2f}')
     ax.legend(facecolor='white', edgecolor='white', labelcolor='#2c2c2c', title=f'# Votes: {tot_votes}')
 
-    # save the plot to a string buffer
+    # save the plot to a bytes buffer; the figure is never registered with
+    # pyplot, so it is freed with the last reference
     buf = io.BytesIO()
-    plt.savefig(buf, format='png', bbox_inches='tight')
-    buf.seek(0)
-    img_data = base64.b64encode(buf.read()).decode('utf-8')
+    fig.savefig(buf, format='png', bbox_inches='tight')
+    png = buf.getvalue()
     buf.close()
+    return png
+
+def get_stats_chart(data):
+    """Returns (png, etag) from the LRU cache, rendering on a miss."""
+    votes_key = tuple(int(item[1]) for item in data)
+    with chart_cache_lock:
+        cached = chart_cache.get(votes_key)
+        if cached is not None:
+            chart_cache.move_to_end(votes_key)
+            return cached
+    # render outside the lock so other users' hits aren't blocked
+    started = time.perf_counter()
+    png = render_stats_chart(data)
+    chart_render_duration.observe(time.perf_counter() - started)
+    cached = (png, get_chart_etag(votes_key))
+    with chart_cache_lock:
+        chart_cache[votes_key] = cached
+        chart_cache.move_to_end(votes_key)
+        while len(chart_cache) > CHART_CACHE_SIZE:
+            chart_cache.popitem(last=False)
+    return cached
+
+# Stats
+@bp.route('/stats', methods=["GET"])
+@login_required
+def stats():
+    """Display user-level stats (for now).
+    The chart itself is served by stats_chart() so browsers can revalidate it.
+    """
+    return render_template('stats.html')
+
+@bp.route('/stats/chart.png', methods=["GET"])
+@login_required
+def stats_chart():
+    """Serves the stats chart with a strong ETag; 304 when votes are unchanged."""
+    # query voting stats
+    data = query_voting_stats()
+    votes_key = tuple(int(item[1]) for item in data)
+    etag = get_chart_etag(votes_key)
+    if request.if_none_match.contains(etag):
+        response = make_response('', 304)
+    else:
+        png, etag = get_stats_chart(data)
+        response = make_response(png)
+        response.mimetype = 'image/png'
+    response.set_etag(etag)
+    # always revalidate: the chart changes as soon as the user votes again
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+# pre-pay heavy imports at import time when asked to
+if os.environ.get('WARM_UP') == '1':
+    warm_up()
+
+## Data Export and Import
+
+# tables stream out in id order through one read transaction (yield_per,
+# so memory stays flat and, in WAL mode, writers are never blocked) and
+# come back in batched inserts, one short transaction per batch; a
+# <dump>.manifest.json records the row count and a checksum of the rows
+# that the importer verifies before and after loading. Password hashes are
+# never exported: imported users get UNUSABLE_PASSWORD and can't log in.
+EXPORT_BATCH_SIZE = int(os.environ.get('EXPORT_BATCH_SIZE', 10000))
+UNUSABLE_PASSWORD = '!'
+# columns as (name, kind): an array typecode for integers, 'text' or
+# 'datetime'
+EXPORT_TABLES = {
+    'users': (User, [('id', 'i'), ('username', 'text')])
+    , 'puns': (Puns, [('id', 'i'), ('question', 'text'), ('answer', 'text'), ('blame', 'text')])
+    , 'ratings': (Ratings, [
+        ('id', 'i'), ('user_id', 'i'), ('pun_id', 'i'), ('rating', 'b'), ('created_at', 'datetime')
+    ])
+}
+# NULL in CSV dumps (as in PostgreSQL's COPY), so None and '' survive
+CSV_NULL = '\\N'
+# columnar layout:
+#   header: magic, u32 length + json of table and columns
+#   blocks: u32 row count, then per column u32 length + bytes: little-endian
+#     arrays for integers and datetimes (microseconds since the epoch),
+#     u32 lengths + utf-8 for text; a row count of 0 ends the file
+COLUMNAR_MAGIC = b'PUNSCOL1'
+COLUMNAR_U32 = struct.Struct('<I')
+COLUMNAR_NULL_LENGTH = 0xFFFFFFFF
+COLUMNAR_NULL_TIME = -2 ** 63
+EPOCH = datetime(1970, 1, 1)
+
+def update_checksum(digest, batch):
+    """Folds rows into a sha256 that only depends on the row values: the
+    repr of each row tuple, one per line, however the rows are batched."""
+    digest.update(''.join([f"{row!r}\n" for row in batch]).encode('utf-8'))
+
+def parse_value(kind, text):
+    """Value of a CSV field or JSON datetime string."""
+    if text is None or text == CSV_NULL:
+        return None
+    if kind == 'text':
+        return text
+    if kind == 'datetime':
+        return datetime.fromisoformat(text)
+    return int(text)
+
+def write_csv(outfile, columns, batches):
+    writer = csv.writer(outfile)
+    writer.writerow([name for name, _ in columns])
+    for batch in batches:
+        writer.writerows(
+            [
+                CSV_NULL if value is None else value.isoformat() if isinstance(value, datetime) else value
+                for value in row
+            ]
+            for row in batch
+        )
+
+def read_csv(infile, columns, batch_size):
+    reader = csv.reader(infile)
+    if next(reader, None) != [name for name, _ in columns]:
+        raise ValueError("CSV header doesn't match the table's columns.")
+    batch = []
+    for fields in reader:
+        batch.append(tuple(parse_value(kind, field) for (_, kind), field in zip(columns, fields)))
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def write_jsonl(outfile, columns, batches):
+    names = [name for name, _ in columns]
+    for batch in batches:
+        outfile.writelines(
+            json.dumps(dict(zip(names, row)), default=datetime.isoformat, ensure_ascii=False) + '\n'
+            for row in batch
+        )
+
+def read_jsonl(infile, columns, batch_size):
+    batch = []
+    for line in infile:
+        record = json.loads(line)
+        batch.append(tuple(
+            parse_value(kind, record[name]) if kind == 'datetime' else record[name] for name, kind in columns
+        ))
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def little_endian(values):
+    """The array's bytes in little-endian order."""
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values.tobytes()
+
+def encode_column(kind, values):
+    if kind == 'text':
+        lengths, data = array('I'), []
+        for value in values:
+            if value is None:
+                lengths.append(COLUMNAR_NULL_LENGTH)
+            else:
+                encoded = value.encode('utf-8')
+                lengths.append(len(encoded))
+                data.append(encoded)
+        return [little_endian(lengths), b''.join(data)]
+    if kind == 'datetime':
+        values = [
+            COLUMNAR_NULL_TIME if value is None else (value - EPOCH) // timedelta(microseconds=1)
+            for value in values
+        ]
+        return [little_endian(array('q', values))]
+    return [little_endian(array(kind, values))]
+
+def decode_column(kind, parts):
+    if kind == 'text':
+        lengths, data = array('I'), parts[1]
+        lengths.frombytes(parts[0])
+        if sys.byteorder == 'big':
+            lengths.byteswap()
+        values, offset = [], 0
+        for length in lengths:
+            if length == COLUMNAR_NULL_LENGTH:
+                values.append(None)
+            else:
+                values.append(data[offset:offset + length].decode('utf-8'))
+                offset += length
+        return values
+    values = array('q' if kind == 'datetime' else kind)
+    values.frombytes(parts[0])
+    if sys.byteorder == 'big':
+        values.byteswap()
+    if kind == 'datetime':
+        return [None if value == COLUMNAR_NULL_TIME else EPOCH + timedelta(microseconds=value) for value in values]
+    return values.tolist()
+
+def write_columnar(outfile, columns, batches):
+    header = json.dumps({'columns': columns}).encode('utf-8')
+    outfile.write(COLUMNAR_MAGIC + COLUMNAR_U32.pack(len(header)) + header)
+    for batch in batches:
+        outfile.write(COLUMNAR_U32.pack(len(batch)))
+        for i, (_, kind) in enumerate(columns):
+            for part in encode_column(kind, [row[i] for row in batch]):
+                outfile.write(COLUMNAR_U32.pack(len(part)))
+                outfile.write(part)
+    outfile.write(COLUMNAR_U32.pack(0))
+
+def read_columnar(infile, columns, batch_size):
+    """Yields the dump's own blocks; batch_size only applies to writing."""
+    def read_part():
+        (length,) = COLUMNAR_U32.unpack(infile.read(COLUMNAR_U32.size))
+        return infile.read(length)
+
+    if infile.read(len(COLUMNAR_MAGIC)) != COLUMNAR_MAGIC:
+        raise ValueError("Not a columnar dump.")
+    if [tuple(column) for column in json.loads(read_part())['columns']] != [tuple(column) for column in columns]:
+        raise ValueError("Columnar dump doesn't match the table's columns.")
+    while True:
+        (n_rows,) = COLUMNAR_U32.unpack(infile.read(COLUMNAR_U32.size))
+        if n_rows == 0:
+            return
+        decoded = [
+            decode_column(kind, [read_part() for _ in range(2 if kind == 'text' else 1)])
+            for _, kind in columns
+        ]
+        yield list(zip(*decoded))
+
+# format -> (writer, reader, binary file)
+DUMP_FORMATS = {
+    'csv': (write_csv, read_csv, False)
+    , 'jsonl': (write_jsonl, read_jsonl, False)
+    , 'columnar': (write_columnar, read_columnar, True)
+}
+
+def open_dump(path, mode, binary):
+    if binary:
+        return open(path, mode + 'b')
+    return open(path, mode, encoding='utf-8', newline='')
+
+def checksummed(batches, summary):
+    """Passes batches through, counting rows and updating the checksum."""
+    digest = hashlib.sha256()
+    summary.update(rows=0, min_id=None, max_id=None)
+    for batch in batches:
+        update_checksum(digest, batch)
+        if batch:
+            summary['rows'] += len(batch)
+            summary['min_id'] = batch[0][0] if summary['min_id'] is None else summary['min_id']
+            summary['max_id'] = batch[-1][0]
+        yield batch
+    summary['sha256'] = digest.hexdigest()
+
+def stream_table(conn, table, batch_size, min_id=None, max_id=None):
+    """Batches of a table's exported columns in id order."""
+    model, columns = EXPORT_TABLES[table]
+    query = db.select(*[getattr(model, name) for name, _ in columns]).order_by(model.id)
+    if min_id is not None:
+        query = query.where(model.id.between(min_id, max_id))
+    result = conn.execute(query.execution_options(yield_per=batch_size))
+    for partition in result.partitions():
+        yield [tuple(row) for row in partition]
+
+def manifest_path(path):
+    return f"{path}.manifest.json"
 
-    return render_template('stats.html', img_data=img_data)
+def export_table(table, path, fmt, batch_size=EXPORT_BATCH_SIZE):
+    """Streams a table to path in fmt; returns the manifest it wrote."""
+    writer, _, binary = DUMP_FORMATS[fmt]
+    summary = {}
+    with db.engine.connect() as conn, open_dump(path, 'w', binary) as outfile:
+        writer(outfile, EXPORT_TABLES[table][1], checksummed(stream_table(conn, table, batch_size), summary))
+    manifest = {'table': table, 'format': fmt, 'exported_at': utc_now().isoformat(), **summary}
+    with open(manifest_path(path), 'w', encoding='utf-8') as outfile:
+        json.dump(manifest, outfile, indent=2)
+    logging.info(f"Exported {summary['rows']} {table} rows to '{path}'.")
+    return manifest
 
+def check_summary(manifest, summary, source):
+    if (summary['rows'], summary['sha256']) != (manifest['rows'], manifest['sha256']):
+        raise ValueError(
+            f"{source} has {summary['rows']} rows (sha256 {summary['sha256']}), "
+            f"the manifest says {manifest['rows']} (sha256 {manifest['sha256']})."
+        )
+
+def import_table(path, batch_size=EXPORT_BATCH_SIZE):
+    """Loads a dump into its (empty) id range; returns (table, rows imported).
+    The file is verified against its manifest before anything is written,
+    and the imported rows are read back and verified again afterwards.
+    """
+    with open(manifest_path(path), encoding='utf-8') as infile:
+        manifest = json.load(infile)
+    table = manifest['table']
+    model, columns = EXPORT_TABLES[table]
+    _, reader, binary = DUMP_FORMATS[manifest['format']]
+
+    def batches():
+        with open_dump(path, 'r', binary) as infile:
+            yield from reader(infile, columns, batch_size)
+
+    summary = {}
+    for _ in checksummed(batches(), summary):
+        pass
+    check_summary(manifest, summary, f"'{path}'")
+    if not manifest['rows']:
+        return table, 0
+    with db.engine.connect() as conn:
+        existing = conn.scalar(
+            db.select(db.func.count()).select_from(model)
+                .where(model.id.between(manifest['min_id'], manifest['max_id']))
+        )
+    if existing:
+        raise ValueError(f"{existing} {table} rows already exist in the dump's id range.")
+
+    names = [name for name, _ in columns]
+    if model is User:
+        # usernames are unique too: a clash would only surface mid-import,
+        # after earlier batches were committed
+        username_at = names.index('username')
+        clashes = []
+        with db.engine.connect() as conn:
+            for batch in batches():
+                clashes += conn.scalars(
+                    db.select(User.username).where(User.username.in_([row[username_at] for row in batch]))
+                ).all()
+        if clashes:
+            raise ValueError(f"Usernames already taken ({len(clashes)}), e.g. {', '.join(sorted(clashes)[:5])}.")
+
+    extra = {'password': UNUSABLE_PASSWORD} if model is User else {}
+    imported = 0
+    last_id = None
+    for batch in batches():
+        try:
+            with db.engine.begin() as conn:
+                conn.execute(db.insert(model), [{**dict(zip(names, row)), **extra} for row in batch])
+        except IntegrityError as e:
+            # e.g. a row inserted since the checks above; this batch rolled
+            # back, the earlier ones stay committed
+            committed = f"ids {manifest['min_id']}-{last_id}" if imported else "nothing"
+            raise ValueError(
+                f"Batch after {imported} of {manifest['rows']} {table} rows failed ({e.orig}); "
+                f"{committed} committed, delete those before retrying."
+            ) from e
+        imported += len(batch)
+        last_id = batch[-1][0]
+        logging.info(f"Imported {imported} of {manifest['rows']} {table} rows.")
+
+    summary = {}
+    with db.engine.connect() as conn:
+        for _ in checksummed(
+            stream_table(conn, table, batch_size, manifest['min_id'], manifest['max_id']), summary
+        ):
+            pass
+    check_summary(manifest, summary, f"Imported {table}")
+    return table, imported
+
+@bp.cli.command('export-data')
+@click.argument('tables', nargs=-1, type=click.Choice(list(EXPORT_TABLES)))
+@click.option('--format', 'fmt', default='csv', show_default=True, type=click.Choice(list(DUMP_FORMATS)))
+@click.option('--out-dir', default='exports', show_default=True)
+@click.option('--batch-size', default=EXPORT_BATCH_SIZE, show_default=True, help="Rows fetched per round trip.")
+def export_data_command(tables, fmt, out_dir, batch_size):
+    """Stream tables (default: all) to dump files with manifests."""
+    os.makedirs(out_dir, exist_ok=True)
+    extension = {'columnar': 'bin'}.get(fmt, fmt)
+    for table in tables or EXPORT_TABLES:
+        path = os.path.join(out_dir, f"{table}.{extension}")
+        manifest = export_table(table, path, fmt, batch_size=batch_size)
+        click.echo(f"Exported {manifest['rows']} {table} rows to '{path}' (sha256 {manifest['sha256'][:12]}).")
+
+@bp.cli.command('import-data')
+@click.argument('paths', nargs=-1, required=True, type=click.Path(exists=True, dir_okay=False))
+@click.option('--batch-size', default=EXPORT_BATCH_SIZE, show_default=True, help="Rows per insert transaction.")
+def import_data_command(paths, batch_size):
+    """Load dumps (users, then puns, then ratings) and verify them."""
+    imported_ratings = False
+    for path in paths:
+        try:
+            table, count = import_table(path, batch_size=batch_size)
+        except (OSError, ValueError) as e:
+            raise click.ClickException(f"Import of '{path}' failed: {e}")
+        imported_ratings = imported_ratings or (table == 'ratings' and count > 0)
+        click.echo(f"Imported and verified {count} {table} rows from '{path}'.")
+    if imported_ratings:
+        # counters and cursors are derived from Ratings
+        rebuild_rating_counts()
+        rebuild_pun_rating_counts()
+        rebuild_user_progress()
+        click.echo("Rebuilt rating counts and progress.")
+
+## Application Factory
+
+def create_app(config=None):
+    """Builds an app; config (a mapping) overrides the environment defaults.
+    `flask --app app ...` finds this factory on its own.
+    """
+    app = Flask(__name__)
+    app.config.update(default_config(app))
+    if config:
+        app.config.update(config)
+    app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', database_engine_options(app.config['SQLALCHEMY_DATABASE_URI']))
+    os.makedirs(app.config['JINJA_CACHE_DIR'], exist_ok=True)
+    app.jinja_env.bytecode_cache = FileSystemBytecodeCache(app.config['JINJA_CACHE_DIR'])
+    csrf.init_app(app)
+    db.init_app(app)
+    login_manager.init_app(app)
+    app.extensions['pun_store'] = make_pun_store(app.config)
+    app.register_blueprint(bp)
+    if RATINGS_WRITE_BEHIND:
+        rating_writer.claim(app)
+    return app
+
+def preload(app):
+    """Loads shared read-only state once in a prefork server's master, so
+    workers inherit it copy-on-write: the mmap'ed pun catalog, asset
+    manifest, media report, compiled templates and plotting imports.
+    """
+    with app.app_context():
+        get_pun_catalog()
+        get_asset_manifest()
+        get_media_report()
+        for name in app.jinja_env.list_templates():
+            app.jinja_env.get_template(name)
+    warm_up()
+    # the master never serves: a worker takes the write-behind lock instead
+    rating_writer.release()
+
+def after_fork(app):
+    """Runs in each worker forked from a preloaded master: forgets
+    connections inherited from the master without closing them under the
+    master's feet, starts its log listener (before anything here logs)
+    and, if it's the first worker, takes the write-behind lock.
+    """
+    worker_logs()
+    with app.app_context():
+        db.engine.dispose(close=False)
+    if RATINGS_WRITE_BEHIND:
+        rating_writer.claim(app)
 
 if __name__ == "__main__":
-    # start logs
-    console_handler = logs()
-    # add the console handler to the root logger
-    logging.getLogger('').addHandler(console_handler)
+    app = create_app()
+    # start logs (file + console, written off the request threads; flushed at exit)
+    logs()
     # create database tables given defined models (comment out in production)
     with app.app_context():
         db.create_all()
-        insert_puns()
-    # run the app
+        sync_puns()
+    # the reloader's watcher process never serves; its child writes behind
+    if os.environ.get('WERKZEUG_RUN_MAIN') != 'true':
+        rating_writer.release()
+    # run the app (single process; see wsgi.py for multi-worker servers)
     app.run(debug=True)
-    # app.run(host='0.0.0.0', port=5000) # in production, or just app.run()
-    # close the console handler to avoid resource leaks
-    console_handler.close()
-    logging.getLogger('').removeHandler(console_handler)
\ No newline at end of file
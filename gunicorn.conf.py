@@ -0,0 +1,7 @@
+# gunicorn settings, read from the working directory (see wsgi.py)
+
+def post_fork(server, worker):
+    # threads don't survive fork, so each worker starts its own log
+    # listener; without --preload wsgi.py (and after_fork) only load later
+    from app import worker_logs
+    worker_logs()
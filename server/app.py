@@ -1,7 +1,9 @@
 import io
 import os
 import csv
+import click
 import base64
+import sqlite3
 import logging
 import numpy as np
 import matplotlib.pyplot as plt
@@ -9,6 +11,8 @@ from matplotlib.ticker import MaxNLocator
 from datetime import datetime, timedelta
 from flask import Flask, redirect, url_for, render_template, flash, request, session
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
 from flask_wtf import FlaskForm
 from flask_wtf.csrf import CSRFProtect
 from flask_login import LoginManager, UserMixin, current_user, login_required, login_user, logout_user
@@ -31,6 +35,45 @@ app.permanent_session_lifetime = timedelta(minutes=5)
 app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///database.db'
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
+# connection pool, sized explicitly for threaded servers: one connection
+# per request thread, with a little overflow
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 8))
+DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', 4))
+DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 10))
+
+# SQLite profile: 'production' sets SQLITE_PRAGMAS on every new connection
+# (see set_sqlite_pragmas); 'default' leaves SQLite's defaults alone
+SQLITE_PROFILE = os.environ.get('SQLITE_PROFILE', 'production')
+SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', 5000))
+SQLITE_PRAGMAS = [
+    # readers keep reading while a rating is being written
+    'PRAGMA journal_mode=WAL'
+    # durable at checkpoints; safe from corruption in WAL mode
+    , 'PRAGMA synchronous=NORMAL'
+    # wait for the write lock instead of failing with "database is locked"
+    , f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}"
+    , f"PRAGMA mmap_size={int(os.environ.get('SQLITE_MMAP_SIZE', 256 * 1024 * 1024))}"
+    # negative: KiB rather than pages
+    , f"PRAGMA cache_size=-{int(os.environ.get('SQLITE_CACHE_KIB', 64 * 1024))}"
+    , 'PRAGMA temp_store=MEMORY'
+]
+
+def is_memory_sqlite(uri):
+    return uri in ('sqlite://', 'sqlite:///:memory:') or 'mode=memory' in uri
+
+database_uri = app.config['SQLALCHEMY_DATABASE_URI'] or ''
+# in-memory SQLite uses a per-thread pool that can't be sized
+if database_uri and not is_memory_sqlite(database_uri):
+    engine_options = {
+        'pool_size': DB_POOL_SIZE
+        , 'max_overflow': DB_MAX_OVERFLOW
+        , 'pool_timeout': DB_POOL_TIMEOUT
+    }
+    if database_uri.startswith('sqlite'):
+        # sqlite3's own lock wait, in seconds (busy_timeout covers the rest)
+        engine_options['connect_args'] = {'timeout': SQLITE_BUSY_TIMEOUT_MS / 1000}
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options
+
 # uncomment for creating new database from scratch
 if 'sqlalchemy' in app.extensions:
     del app.extensions['sqlalchemy']
@@ -38,6 +81,33 @@ if 'sqlalchemy' in app.extensions:
 # instantiate database
 db = SQLAlchemy(app)
 
+@event.listens_for(Engine, 'connect')
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    """Applies the SQLite profile to each new pooled connection."""
+    if SQLITE_PROFILE != 'production' or not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    cursor = dbapi_connection.cursor()
+    for pragma in SQLITE_PRAGMAS:
+        cursor.execute(pragma)
+    cursor.close()
+
+def sqlite_maintenance(mode='TRUNCATE'):
+    """Checkpoints the WAL into the database file and refreshes the query
+    planner's statistics. Returns (busy, wal_frames, checkpointed_frames).
+    """
+    with db.engine.connect() as conn:
+        result = tuple(conn.exec_driver_sql(f"PRAGMA wal_checkpoint({mode})").one())
+        conn.exec_driver_sql('PRAGMA optimize')
+    logging.info(f"SQLite maintenance: checkpoint {mode} (busy, wal frames, checkpointed) = {result}.")
+    return result
+
+@app.cli.command('sqlite-maintenance')
+@click.option('--mode', default='TRUNCATE', type=click.Choice(['PASSIVE', 'FULL', 'RESTART', 'TRUNCATE']))
+def sqlite_maintenance_command(mode):
+    """Checkpoint the WAL and run PRAGMA optimize (e.g. hourly from cron)."""
+    busy, wal_frames, checkpointed = sqlite_maintenance(mode)
+    click.echo(f"Checkpointed {checkpointed} of {wal_frames} WAL frames{' (busy)' if busy else ''}.")
+
 # logging for file and console
 def logs():
     if not os.path.exists('logs'):
@@ -0,0 +1,153 @@
+// Confetti zoo and key handling for play.html.
+// The script tag carries the animals to throw, e.g. data-confetti="dragon,owl",
+// so this file never changes per request and can be cached by the browser.
+(function () {
+    var animals = (document.currentScript.dataset.confetti || '').split(',');
+
+    var scalar = 4;
+    var dragon = confetti.shapeFromText({ text: '\u{1F409}', scalar: scalar });
+    var unicorn = confetti.shapeFromText({ text: '\u{1F984}', scalar: scalar });
+    var owl = confetti.shapeFromText({ text: '\u{1F989}', scalar: scalar });
+    var zebra = confetti.shapeFromText({ text: '\u{1F993}', scalar: scalar });
+    var ladybug = confetti.shapeFromText({ text: '\u{1F41E}', scalar: scalar });
+    var jellyfish = confetti.shapeFromText({ text: '\u{1FABC}', scalar: scalar });
+
+    var defaults = {
+        spread: 360,
+        ticks: 140,
+        gravity: 0.8,
+        decay: 0.9,
+        startVelocity: 20,
+        shapes: [unicorn],
+        scalar: scalar
+    };
+
+    function shootDragons() {
+        confetti({
+            ...defaults,
+            shapes: [dragon],
+            particleCount: 17,
+            gravity: 0.05,
+            flat: true,
+            startVelocity: 30,
+            scalar: 8
+        });
+    }
+
+    function shootUnicorns() {
+        confetti({
+            ...defaults,
+            particleCount: 100,
+            scalar: 3
+        });
+        confetti({
+            ...defaults,
+            particleCount: 100,
+            startVelocity: 40,
+            scalar: 3,
+            flat: true
+        });
+        confetti({
+            ...defaults,
+            particleCount: 150,
+            startVelocity: 50,
+            scalar: 1,
+            shapes: ['square']
+        });
+    }
+
+    function shootOwls() {
+        confetti({
+            ...defaults,
+            shapes: [owl],
+            particleCount: 100,
+            gravity: 0.05,
+            flat: true,
+            startVelocity: 35,
+            scalar: 4
+        });
+    }
+
+    function shootZebras() {
+        confetti({
+            ...defaults,
+            shapes: [zebra],
+            particleCount: 100,
+            flat: true,
+            gravity: 1,
+            startVelocity: 30
+        });
+        confetti({
+            ...defaults,
+            shapes: [zebra],
+            particleCount: 20,
+            flat: true,
+            startVelocity: 15
+        });
+    }
+
+    function shootLadybugs() {
+        confetti({
+            ...defaults,
+            shapes: [ladybug],
+            particleCount: 250,
+            gravity: 0.5,
+            flat: true,
+            startVelocity: 35,
+            scalar: 3
+        });
+    }
+
+    function shootJellyfishes() {
+        confetti({
+            ...defaults,
+            shapes: [jellyfish],
+            particleCount: 50,
+            gravity: 0.1,
+            flat: true,
+            startVelocity: 25,
+            scalar: 4
+        });
+        confetti({
+            ...defaults,
+            shapes: [jellyfish],
+            particleCount: 150,
+            gravity: 0.4,
+            startVelocity: 45,
+            scalar: 4
+        });
+    }
+
+    // animal name (see animal_dict in app.py) -> [shoot function, delays in ms]
+    var shots = {
+        dragon: [shootDragons, [0]],
+        unicorn: [shootUnicorns, [0, 150]],
+        owl: [shootOwls, [0]],
+        zebra: [shootZebras, [0]],
+        ladybug: [shootLadybugs, [0]],
+        jellyfish: [shootJellyfishes, [0, 50]]
+    };
+
+    animals.forEach(function (animal) {
+        var shot = shots[animal];
+        if (shot) {
+            shot[1].forEach(function (delay) {
+                setTimeout(shot[0], delay);
+            });
+        }
+    });
+
+    function handleFormSubmission(event) {
+        document.getElementById('playForm').submit();
+    }
+
+    // event listener for key presses (desktop and some mobile devices)
+    document.addEventListener('keydown', function (event) {
+        handleFormSubmission(event);
+    });
+
+    // event listener for touch (mobile and tablets)
+    document.addEventListener('touchstart', function (event) {
+        handleFormSubmission(event);
+    });
+})();
@@ -0,0 +1,79 @@
+import time
+import argparse
+import resource
+import tracemalloc
+import numpy as np
+from bench_common import import_app
+
+# Times the offline collaborative-filtering job (build-pun-queues) on
+# synthetic ratings: sparse matrix build, ALS factorization and ranking of
+# unseen puns, with peak traced memory per stage. Run from the repo root:
+#   python utils/bench_cf.py
+#   python utils/bench_cf.py --users 10000 --puns 5000 --density 0.02
+# Memory should scale with the number of ratings, never users x puns.
+
+parser = argparse.ArgumentParser(description="Collaborative-filtering job benchmark")
+parser.add_argument('--users', type=int, default=10000)
+parser.add_argument('--puns', type=int, default=5000)
+parser.add_argument('--density', type=float, default=0.02, help="fraction of cells rated")
+parser.add_argument('--factors', type=int, default=16)
+parser.add_argument('--iterations', type=int, default=10)
+parser.add_argument('--queue-length', type=int, default=200)
+args = parser.parse_args()
+
+# the job reads no database here
+puns_app, _ = import_app(None)
+
+def synthetic_ratings(rng):
+    """Low-rank 'taste' plus noise, quantized to the 1-6 rating codes."""
+    nnz = int(args.users * args.puns * args.density)
+    rows = rng.integers(0, args.users, nnz)
+    cols = rng.integers(0, args.puns, nnz)
+    user_taste = rng.standard_normal((args.users, 4)).astype(np.float32)
+    pun_taste = rng.standard_normal((args.puns, 4)).astype(np.float32)
+    signal = np.einsum('ij,ij->i', user_taste[rows], pun_taste[cols])
+    values = np.clip(np.rint(3.5 + signal + rng.standard_normal(nnz)), 1, 6).astype(np.int8)
+    return rows, cols, values
+
+def stage(name, func, *func_args, **kwargs):
+    tracemalloc.reset_peak()
+    start = time.perf_counter()
+    result = func(*func_args, **kwargs)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    print(f"{name:<12} {elapsed:8.2f}s  peak {peak / 2**20:8.1f} MiB")
+    return result
+
+def rank_all(matrix, user_factors, pun_factors):
+    total = 0
+    for _, ranked in puns_app.rank_unseen_puns(
+        matrix, user_factors, pun_factors, queue_length=args.queue_length
+    ):
+        total += len(ranked)
+    return total
+
+def main():
+    rng = np.random.default_rng(0)
+    rows, cols, values = synthetic_ratings(rng)
+    dense_mib = args.users * args.puns * 4 / 2**20
+    print(f"{args.users} users x {args.puns} puns, {len(values)} ratings "
+          f"(a dense float32 matrix would be {dense_mib:.0f} MiB)")
+
+    tracemalloc.start()
+    matrix = stage('sparse', puns_app.build_sparse_ratings, rows, cols, values, (args.users, args.puns))
+    user_factors, pun_factors, mean = stage(
+        'factorize', puns_app.factorize_ratings, matrix
+        , factors=args.factors, iterations=args.iterations
+    )
+    queued = stage('rank', rank_all, matrix, user_factors, pun_factors)
+    tracemalloc.stop()
+
+    # training error on the observed ratings, as a sanity check
+    row_ids = np.repeat(np.arange(matrix.shape[0]), np.diff(matrix.indptr))
+    predicted = mean + np.einsum('ij,ij->i', user_factors[row_ids], pun_factors[matrix.indices])
+    rmse = float(np.sqrt(np.mean((predicted - matrix.data) ** 2)))
+    print(f"train rmse {rmse:.3f}, {queued} queued puns, "
+          f"max rss {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f} MiB")
+
+if __name__ == "__main__":
+    main()
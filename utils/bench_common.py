@@ -0,0 +1,37 @@
+import os
+import sys
+import tempfile
+
+# Scaffolding shared by the benchmark scripts in utils/ (bench_*.py,
+# loadtest.py). They run from the repo root, e.g. python utils/bench_cf.py,
+# so this module is imported from next to them and app.py from the
+# working directory.
+
+def import_app(db_file='bench.db', **env):
+    """Configures the app before importing it: a SQLite database in a fresh
+    temporary directory (db_file None: in memory), a default SECRET_KEY and
+    any environment overrides. Returns (app module, temporary directory).
+    """
+    work_dir = tempfile.mkdtemp()
+    if db_file is None:
+        os.environ['DATABASE_URL'] = 'sqlite://'
+    else:
+        os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(work_dir, db_file)}"
+    os.environ.setdefault('SECRET_KEY', 'bench')
+    os.environ.update(env)
+    sys.path.insert(0, os.getcwd())
+    import app as puns_app
+    return puns_app, work_dir
+
+def seed_puns(puns_app, n):
+    """Adds puns 1..n to the session (in an app context; caller commits)."""
+    db = puns_app.db
+    db.session.execute(db.insert(puns_app.Puns), [
+        {'id': i, 'question': f"Question {i}", 'answer': f"answer {i}", 'blame': ''} for i in range(1, n + 1)
+    ])
+
+def percentile(values, pct):
+    """Nearest-rank percentile of sorted values; None if there are none."""
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))]
@@ -0,0 +1,97 @@
+import os
+import time
+import random
+import logging
+import argparse
+import resource
+import tracemalloc
+from datetime import datetime, timedelta
+from bench_common import import_app
+
+# Times export-data / import-data on synthetic data: streams users, puns
+# and ratings out in every dump format, loads each dump into a fresh
+# database and verifies it, reporting time, file size and peak RSS.
+# Peak Python heap (--trace-memory) should stay flat as --ratings grows;
+# RSS also counts SQLite's page cache and mmap. Run from the repo root:
+#   python utils/bench_export.py
+#   python utils/bench_export.py --ratings 1000000 --formats columnar --trace-memory
+
+parser = argparse.ArgumentParser(description="Export/import round-trip benchmark")
+parser.add_argument('--users', type=int, default=2000)
+parser.add_argument('--puns', type=int, default=500)
+parser.add_argument('--ratings', type=int, default=200000)
+parser.add_argument('--formats', default='csv,jsonl,columnar')
+parser.add_argument('--batch-size', type=int, default=10000)
+parser.add_argument('--trace-memory', action='store_true', help="report peak Python heap (slows the run)")
+args = parser.parse_args()
+
+# seed() writes its own puns, with quotes and newlines for the dump formats
+puns_app, work_dir = import_app('source.db')
+
+db = puns_app.db
+logging.disable(logging.INFO)
+
+def seed(app):
+    rng = random.Random(0)
+    start = datetime(2024, 1, 1)
+    with app.app_context():
+        db.create_all()
+        db.session.execute(db.insert(puns_app.User), [
+            {'username': f"user{i:05d}", 'password': 'x'} for i in range(args.users)
+        ])
+        db.session.execute(db.insert(puns_app.Puns), [
+            {'question': f"Why pun {i}?", 'answer': f"Because, \"{i}\",\nthat's why", 'blame': None if i % 3 else ''}
+            for i in range(args.puns)
+        ])
+        for offset in range(0, args.ratings, args.batch_size):
+            db.session.execute(db.insert(puns_app.Ratings), [
+                {
+                    'user_id': rng.randint(1, args.users)
+                    , 'pun_id': rng.randint(1, args.puns)
+                    , 'rating': rng.randint(1, 6)
+                    , 'created_at': None if i % 50 == 0 else start + timedelta(seconds=i)
+                }
+                for i in range(offset, min(offset + args.batch_size, args.ratings))
+            ])
+        db.session.commit()
+
+def main():
+    source = puns_app.create_app()
+    seed(source)
+    print(f"{args.users} users, {args.puns} puns, {args.ratings} ratings")
+    print(f"{'format':<10} {'export_s':>9} {'import_s':>9} {'ratings_mb':>11} {'peak_heap_mb':>13}")
+    if args.trace_memory:
+        tracemalloc.start()
+    for fmt in args.formats.split(','):
+        out_dir = os.path.join(work_dir, fmt)
+        os.makedirs(out_dir)
+        if args.trace_memory:
+            tracemalloc.reset_peak()
+        extension = {'columnar': 'bin'}.get(fmt, fmt)
+        paths = [os.path.join(out_dir, f"{table}.{extension}") for table in puns_app.EXPORT_TABLES]
+
+        start = time.perf_counter()
+        with source.app_context():
+            for table, path in zip(puns_app.EXPORT_TABLES, paths):
+                puns_app.export_table(table, path, fmt, batch_size=args.batch_size)
+        export_s = time.perf_counter() - start
+
+        target = puns_app.create_app({
+            'SQLALCHEMY_DATABASE_URI': f"sqlite:///{os.path.join(out_dir, 'target.db')}"
+        })
+        start = time.perf_counter()
+        with target.app_context():
+            db.create_all()
+            # import_table raises if a count or checksum doesn't match
+            for path in paths:
+                puns_app.import_table(path, batch_size=args.batch_size)
+            db.engine.dispose()
+        import_s = time.perf_counter() - start
+
+        ratings_mb = os.path.getsize(paths[-1]) / 2**20
+        peak_heap = f"{tracemalloc.get_traced_memory()[1] / 2**20:.1f}" if args.trace_memory else '-'
+        print(f"{fmt:<10} {export_s:>9.2f} {import_s:>9.2f} {ratings_mb:>11.1f} {peak_heap:>13}")
+    print(f"max rss {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f} MiB")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+import json
+import time
+import logging
+import argparse
+import threading
+from bench_common import import_app, seed_puns, percentile
+
+# Mixed-load benchmark: login threads hammer /login (argon2 verify) while
+# play threads keep requesting /play. Reports login throughput, 503s from
+# hashing admission control, and /play latency percentiles. Run from the
+# repo root, e.g. compare the hash pool against inline hashing:
+#   python utils/bench_login.py --pool-size 2
+#   python utils/bench_login.py --pool-size 0
+
+parser = argparse.ArgumentParser(description="Login vs /play mixed-load benchmark")
+parser.add_argument('--pool-size', type=int, default=2, help="HASH_POOL_SIZE; 0 hashes inline")
+parser.add_argument('--queue-limit', type=int, default=8, help="HASH_QUEUE_LIMIT")
+parser.add_argument('--login-threads', type=int, default=8)
+parser.add_argument('--play-threads', type=int, default=4)
+parser.add_argument('--duration', type=float, default=10.0, help="seconds")
+args = parser.parse_args()
+
+password = 'benchpassword'
+stop = threading.Event()
+lock = threading.Lock()
+results = {'logins_ok': 0, 'logins_busy': 0, 'play_latencies': []}
+
+def setup():
+    """Configures, imports and seeds the app (in main(): the hash pool's
+    processes re-import this script, and must not rerun the benchmark)."""
+    puns_app, _ = import_app(HASH_POOL_SIZE=str(args.pool_size), HASH_QUEUE_LIMIT=str(args.queue_limit))
+    app = puns_app.create_app()
+    db = puns_app.db
+    app.config['WTF_CSRF_ENABLED'] = False
+    # admission control warnings are expected under this load
+    logging.disable(logging.WARNING)
+
+    # seed puns and users
+    with app.app_context():
+        db.create_all()
+        seed_puns(puns_app, 50)
+        hashed = puns_app.ph.hash(password)
+        n_users = args.login_threads + args.play_threads
+        db.session.execute(db.insert(puns_app.User), [
+            {'username': f"bench{i:03d}", 'password': hashed} for i in range(n_users)
+        ])
+        db.session.commit()
+    return app
+
+def make_client(app, i):
+    client = app.test_client()
+    # distinct addresses so a per-IP cap (HASH_IP_LIMIT) applies per simulated user
+    client.environ_base['REMOTE_ADDR'] = f"10.0.{i // 256}.{i % 256}"
+    return client
+
+def login_worker(app, i):
+    while not stop.is_set():
+        client = make_client(app, i)
+        response = client.post('/login', data={'username': f"bench{i:03d}", 'password': password})
+        with lock:
+            if response.status_code == 302:
+                results['logins_ok'] += 1
+            elif response.status_code == 503:
+                results['logins_busy'] += 1
+
+def play_worker(app, i):
+    client = make_client(app, i)
+    client.post('/login', data={'username': f"bench{i:03d}", 'password': password})
+    latencies = []
+    while not stop.is_set():
+        start = time.perf_counter()
+        client.get('/play')
+        latencies.append(time.perf_counter() - start)
+    with lock:
+        results['play_latencies'].extend(latencies)
+
+def main():
+    app = setup()
+    threads = [threading.Thread(target=login_worker, args=(app, i)) for i in range(args.login_threads)]
+    threads += [
+        threading.Thread(target=play_worker, args=(app, args.login_threads + i)) for i in range(args.play_threads)
+    ]
+    for thread in threads:
+        thread.start()
+    time.sleep(args.duration)
+    stop.set()
+    for thread in threads:
+        thread.join()
+
+    latencies = sorted(results['play_latencies'])
+    print(json.dumps({
+        'pool_size': args.pool_size
+        , 'queue_limit': args.queue_limit
+        , 'duration_s': args.duration
+        , 'logins_per_s': round(results['logins_ok'] / args.duration, 1)
+        , 'logins_busy_503': results['logins_busy']
+        , 'play_requests': len(latencies)
+        , 'play_p50_ms': round(percentile(latencies, 50) * 1000, 2) if latencies else None
+        , 'play_p99_ms': round(percentile(latencies, 99) * 1000, 2) if latencies else None
+    }, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+import sys
+import json
+import time
+import logging
+import argparse
+import multiprocessing
+from bench_common import import_app, seed_puns, percentile
+
+# Concurrency check for the SQLite profile: writer processes store ratings
+# through the app's write path (ratings + counters + cursor in one
+# transaction) while reader processes keep reading the rows being updated,
+# like forked server workers. Processes rather than threads, so the GIL
+# doesn't drown out database locking.
+# Reports read/write throughput, read latency and "database is locked"
+# failures, and exits 1 if readers were blocked past the budget or any
+# operation failed. Run from the repo root, and compare with SQLite defaults:
+#   python utils/bench_sqlite.py
+#   python utils/bench_sqlite.py --profile default
+
+parser = argparse.ArgumentParser(description="SQLite readers-vs-writers concurrency check")
+parser.add_argument('--profile', default='production', choices=['production', 'default'], help="SQLITE_PROFILE")
+parser.add_argument('--writers', type=int, default=4)
+parser.add_argument('--readers', type=int, default=8)
+parser.add_argument('--think-ms', type=float, default=5.0, help="reader pause between reads (keeps CPU free)")
+parser.add_argument('--duration', type=float, default=5.0, help="seconds")
+parser.add_argument('--max-read-p99-ms', type=float, default=50.0, help="fail above this read p99")
+args = parser.parse_args()
+
+puns_app, _ = import_app(SQLITE_PROFILE=args.profile, RATINGS_WRITE_BEHIND='0')
+
+app = puns_app.create_app()
+db = puns_app.db
+logging.disable(logging.INFO)
+n_puns = 100
+ratings = list(puns_app.rating_codes)
+
+with app.app_context():
+    db.create_all()
+    seed_puns(puns_app, n_puns)
+    db.session.execute(db.insert(puns_app.User), [
+        {'username': f"bench{i:03d}", 'password': 'x'} for i in range(args.writers)
+    ])
+    db.session.commit()
+    journal_mode = db.session.execute(db.text('PRAGMA journal_mode')).scalar()
+
+def forked():
+    """Fresh connections in the child; the parent's stay untouched."""
+    puns_app.after_fork(app)
+
+def writer(user_id, deadline, results):
+    forked()
+    pun_id = writes = errors = 0
+    while time.monotonic() < deadline:
+        pun_id = pun_id % n_puns + 1
+        try:
+            with app.app_context():
+                puns_app.Ratings.store_ratings(user_id=user_id, pun_id=pun_id, rating=ratings[pun_id % 6])
+            writes += 1
+        except Exception as e:
+            logging.warning(f"Write failed: {e}")
+            errors += 1
+    results.put(('write', writes, errors, []))
+
+def reader(i, deadline, results):
+    forked()
+    latencies = []
+    errors = 0
+    while time.monotonic() < deadline:
+        start = time.perf_counter()
+        try:
+            with app.app_context():
+                # the rows the writers keep updating
+                db.session.get(puns_app.UserRatingCounts, i % args.writers + 1)
+                db.session.get(puns_app.PunRatingCounts, i % n_puns + 1)
+                db.session.get(puns_app.UserProgress, i % args.writers + 1)
+        except Exception as e:
+            logging.warning(f"Read failed: {e}")
+            errors += 1
+        latencies.append(time.perf_counter() - start)
+        time.sleep(args.think_ms / 1000)
+    results.put(('read', len(latencies), errors, latencies))
+
+ctx = multiprocessing.get_context('fork')
+queue = ctx.Queue()
+deadline = time.monotonic() + args.duration
+processes = [ctx.Process(target=writer, args=(i + 1, deadline, queue)) for i in range(args.writers)]
+processes += [ctx.Process(target=reader, args=(i, deadline, queue)) for i in range(args.readers)]
+for process in processes:
+    process.start()
+results = {'writes': 0, 'write_errors': 0, 'read_latencies': [], 'read_errors': 0}
+for _ in processes:
+    kind, count, errors, latencies = queue.get()
+    if kind == 'write':
+        results['writes'] += count
+        results['write_errors'] += errors
+    else:
+        results['read_latencies'].extend(latencies)
+        results['read_errors'] += errors
+for process in processes:
+    process.join()
+
+latencies = sorted(results['read_latencies'])
+read_p99_ms = 1000 * percentile(latencies, 99)
+report = {
+    'profile': args.profile
+    , 'journal_mode': journal_mode
+    , 'writes_per_s': round(results['writes'] / args.duration, 1)
+    , 'write_errors': results['write_errors']
+    , 'reads_per_s': round(len(latencies) / args.duration, 1)
+    , 'read_errors': results['read_errors']
+    , 'read_p50_ms': round(1000 * percentile(latencies, 50), 2)
+    , 'read_p99_ms': round(read_p99_ms, 2)
+    , 'read_max_ms': round(1000 * latencies[-1], 2)
+}
+print(json.dumps(report, indent=2))
+
+failures = []
+if results['write_errors'] or results['read_errors']:
+    failures.append(f"{results['write_errors']} write / {results['read_errors']} read errors")
+if read_p99_ms > args.max_read_p99_ms:
+    failures.append(f"read p99 {read_p99_ms:.1f}ms > {args.max_read_p99_ms}ms")
+if failures:
+    print(f"FAIL: {'; '.join(failures)}")
+    sys.exit(1)
+print("OK: readers were not blocked by the rating writes.")
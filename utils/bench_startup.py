@@ -0,0 +1,70 @@
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+
+# Measures cold import time and RSS of app.py (import plus create_app()), one
+# fresh interpreter per run, the same way every new worker pays for it. Run
+# from the repo root:
+#   python utils/bench_startup.py --runs 5 --max-import-ms 800 --max-rss-mb 80
+# Budgets can also come from STARTUP_MAX_IMPORT_MS and STARTUP_MAX_RSS_MB.
+# Exits 1 when the median import time or the max RSS is over budget.
+
+# child process: import the app and report how long it took and peak RSS
+child_code = """
+import json, time, resource, sys
+start = time.perf_counter()
+import app
+app.create_app()
+if {warm}:
+    app.warm_up()
+elapsed_ms = (time.perf_counter() - start) * 1000
+rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+if sys.platform == 'darwin':
+    rss_kb = rss_kb / 1024
+print(json.dumps({{'import_ms': elapsed_ms, 'rss_mb': rss_kb / 1024}}))
+"""
+
+def measure_once(warm):
+    env = dict(os.environ)
+    # app.py needs a database uri to import; nothing is written to it
+    env.setdefault('DATABASE_URL', 'sqlite://')
+    env.setdefault('SECRET_KEY', 'bench')
+    env.pop('WARM_UP', None)
+    result = subprocess.run(
+        [sys.executable, '-c', child_code.format(warm=warm)]
+        , capture_output=True, text=True, env=env, check=True
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+def main():
+    parser = argparse.ArgumentParser(description="Cold import benchmark for app.py")
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--warm', action='store_true', help="also call app.warm_up()")
+    parser.add_argument('--max-import-ms', type=float, default=os.environ.get('STARTUP_MAX_IMPORT_MS'))
+    parser.add_argument('--max-rss-mb', type=float, default=os.environ.get('STARTUP_MAX_RSS_MB'))
+    args = parser.parse_args()
+
+    runs = [measure_once(args.warm) for _ in range(args.runs)]
+    import_ms = statistics.median(r['import_ms'] for r in runs)
+    rss_mb = max(r['rss_mb'] for r in runs)
+    print(json.dumps({
+        'runs': args.runs
+        , 'warm': args.warm
+        , 'median_import_ms': round(import_ms, 1)
+        , 'max_rss_mb': round(rss_mb, 1)
+    }, indent=2))
+
+    failed = False
+    if args.max_import_ms is not None and import_ms > args.max_import_ms:
+        print(f"FAIL: median import {import_ms:.1f} ms > budget {args.max_import_ms} ms")
+        failed = True
+    if args.max_rss_mb is not None and rss_mb > args.max_rss_mb:
+        print(f"FAIL: max RSS {rss_mb:.1f} MB > budget {args.max_rss_mb} MB")
+        failed = True
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
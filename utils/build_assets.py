@@ -0,0 +1,142 @@
+import os
+import sys
+import gzip
+import json
+import base64
+import shutil
+import hashlib
+import argparse
+import urllib.request
+
+# Builds fingerprinted, precompressed copies of the static assets into
+# static/dist/ plus a manifest.json that the app's asset_url() helper reads.
+# Run from the repo root after changing anything under static/:
+#   python utils/build_assets.py --vendor   # first time: fetch third-party files
+#   python utils/build_assets.py
+# The build fails while a vendored file is missing or doesn't match its
+# pinned sha384, so a build never ships unchecked third-party code.
+# Brotli variants are written when the optional `brotli` package is installed.
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+static_dir = 'static'
+dist_dir = os.path.join(static_dir, 'dist')
+manifest_path = os.path.join(dist_dir, 'manifest.json')
+
+# asset folders to fingerprint (static/files holds data, not assets)
+asset_dirs = ['css', 'img', 'js', 'vendor']
+
+# text formats worth precompressing; images are already compressed
+compressible_exts = {'.css', '.js', '.svg', '.json', '.txt', '.map'}
+
+# third-party files served locally instead of from a CDN
+# (path under static/, source url, sha384 integrity; None until pinned, and
+# vendor() refuses unpinned files)
+vendor_files = [
+    (
+        'vendor/bootstrap.min.css'
+        , 'https://cdn.jsdelivr.net/npm/bootstrap@5.3.2/dist/css/bootstrap.min.css'
+        , 'sha384-T3c6CoIi6uLrA9TneNEoa7RxnatzjcDSCmG1MXxSR1GAsXEV/Dwwykc2MPK8M2HN'
+    ),
+    (
+        'vendor/bootstrap.bundle.min.js'
+        , 'https://cdn.jsdelivr.net/npm/bootstrap@5.3.2/dist/js/bootstrap.bundle.min.js'
+        , 'sha384-C6RzsynM9kWDrMNeT87bh95OGNyZPhcTNXj1NW7RuBCsyN/o0jlpcV8Qyq46cDfL'
+    ),
+    (
+        'vendor/confetti.browser.min.js'
+        , 'https://cdn.jsdelivr.net/npm/canvas-confetti@1.9.2/dist/confetti.browser.min.js'
+        , None
+    ),
+]
+
+def sri_digest(content):
+    return 'sha384-' + base64.b64encode(hashlib.sha384(content).digest()).decode('ascii')
+
+def vendor():
+    """Downloads vendor_files into static/; each must match its pinned sha384."""
+    for path, url, integrity in vendor_files:
+        with urllib.request.urlopen(url, timeout=30) as response:
+            content = response.read()
+        digest = sri_digest(content)
+        if integrity is None:
+            print(f"Error: no sha384 pinned for '{url}', which downloaded as {digest}. "
+                  "Check it against the upstream release and pin it in vendor_files.")
+            sys.exit(1)
+        if digest != integrity:
+            print(f"Error: integrity mismatch for '{url}': got {digest}")
+            sys.exit(1)
+        out_path = os.path.join(static_dir, path)
+        os.makedirs(os.path.dirname(out_path), exist_ok=True)
+        with open(out_path, 'wb') as outfile:
+            outfile.write(content)
+        print(f"Vendored '{url}' as '{out_path}' ({digest}).")
+
+def check_vendor():
+    """Exits if a vendored file is missing or isn't the pinned one."""
+    for path, url, integrity in vendor_files:
+        vendor_path = os.path.join(static_dir, path)
+        if not os.path.isfile(vendor_path):
+            print(f"Error: '{vendor_path}' is missing; run with --vendor.")
+            sys.exit(1)
+        with open(vendor_path, 'rb') as infile:
+            digest = sri_digest(infile.read())
+        if digest != integrity:
+            print(f"Error: '{vendor_path}' is {digest}, not the pinned {integrity}.")
+            sys.exit(1)
+
+def fingerprint(path, content):
+    """css/styles.css -> css/styles.<hash>.css"""
+    stem, ext = os.path.splitext(path)
+    return f"{stem}.{hashlib.sha256(content).hexdigest()[:12]}{ext}"
+
+def write_variants(out_path, content):
+    """Writes the file plus .gz/.br variants when they are smaller."""
+    os.makedirs(os.path.dirname(out_path), exist_ok=True)
+    with open(out_path, 'wb') as outfile:
+        outfile.write(content)
+    if os.path.splitext(out_path)[1] not in compressible_exts:
+        return
+    # mtime=0 keeps builds reproducible
+    gz_content = gzip.compress(content, compresslevel=9, mtime=0)
+    if len(gz_content) < len(content):
+        with open(out_path + '.gz', 'wb') as outfile:
+            outfile.write(gz_content)
+    if brotli is not None:
+        br_content = brotli.compress(content, quality=11)
+        if len(br_content) < len(content):
+            with open(out_path + '.br', 'wb') as outfile:
+                outfile.write(br_content)
+
+def build():
+    """Rebuilds static/dist/ and its manifest from scratch."""
+    check_vendor()
+    if os.path.exists(dist_dir):
+        shutil.rmtree(dist_dir)
+    manifest = {}
+    for asset_dir in asset_dirs:
+        for root, _, files in os.walk(os.path.join(static_dir, asset_dir)):
+            for name in sorted(files):
+                src_path = os.path.join(root, name)
+                path = os.path.relpath(src_path, static_dir).replace(os.sep, '/')
+                with open(src_path, 'rb') as infile:
+                    content = infile.read()
+                hashed_path = fingerprint(path, content)
+                write_variants(os.path.join(dist_dir, hashed_path), content)
+                manifest[path] = hashed_path
+    with open(manifest_path, 'w', encoding='utf-8') as outfile:
+        json.dump(manifest, outfile, indent=2, sort_keys=True)
+    print(f"Built {len(manifest)} assets into '{dist_dir}'.")
+    if brotli is None:
+        print("Note: brotli not installed, only gzip variants were written.")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fingerprint and precompress static assets")
+    parser.add_argument('--vendor', action='store_true', help="download vendor_files first")
+    args = parser.parse_args()
+    if args.vendor:
+        vendor()
+    build()
@@ -0,0 +1,259 @@
+import os
+import re
+import sys
+import json
+import time
+import logging
+import argparse
+import threading
+import subprocess
+import http.cookiejar
+import urllib.error
+import urllib.parse
+import urllib.request
+from sqlalchemy import event
+from bench_common import import_app, seed_puns, percentile
+
+# End-to-end load test: each simulated user signs up, logs in, then plays
+# rounds of play -> view_answer -> rate, checking stats (the page, then its
+# chart, then revalidating the chart by ETag) every few rounds.
+# CSRF tokens are read from the pages like a browser would. Reports
+# throughput and p50/p95/p99 latency per route, plus SQL statements per
+# request (counted in-process, or read from the X-SQL-Stats header of a
+# server running with SQL_INSTRUMENTATION=1), and saves the results as JSON for
+# comparing commits. Run from the repo root:
+#   python utils/loadtest.py --users 20 --rounds 20 --out before.json
+#   python utils/loadtest.py --users 20 --rounds 20 --compare before.json
+# Against a running server (its BETA_USERS must allow the generated
+# usernames, e.g. BETA_USERS=$(python utils/loadtest.py --print-users ...)):
+#   python utils/loadtest.py --url http://127.0.0.1:5000 --prefix lt0001
+
+parser = argparse.ArgumentParser(description="signup/login/play/stats load test")
+parser.add_argument('--url', help="base url of a running server; default is the in-process test client")
+parser.add_argument('--users', type=int, default=20, help="concurrent simulated users")
+parser.add_argument('--rounds', type=int, default=20, help="puns rated per user")
+parser.add_argument('--stats-every', type=int, default=5, help="rounds between /stats visits")
+parser.add_argument('--puns', type=int, default=500, help="puns to seed (test client only)")
+parser.add_argument('--prefix', default=None, help="username prefix (default: random per run)")
+parser.add_argument('--password', default='loadtest123')
+parser.add_argument('--print-users', action='store_true', help="print the BETA_USERS value and exit")
+parser.add_argument('--out', help="write results JSON here")
+parser.add_argument('--compare', help="results JSON of an earlier run to diff against")
+args = parser.parse_args()
+
+prefix = args.prefix or f"lt{os.urandom(3).hex()}"
+usernames = [f"{prefix}{i:04d}" for i in range(args.users)]
+if args.print_users:
+    print(','.join(usernames))
+    sys.exit(0)
+
+ratings = ['no', 'wut', 'sigh', 'eyeroll', 'groan', 'panic']
+csrf_pattern = re.compile(r'<meta name="csrf_token" content="([^"]+)"')
+
+class TestClientSession:
+    """One simulated browser on the in-process Flask test client."""
+
+    def __init__(self, app, i):
+        self.client = app.test_client()
+        # distinct addresses so a per-IP hashing cap (HASH_IP_LIMIT) applies per user
+        self.client.environ_base['REMOTE_ADDR'] = f"10.1.{i // 256}.{i % 256}"
+
+    def request(self, method, path, data=None, headers=None):
+        response = self.client.open(path, method=method, data=data, headers=headers)
+        return response.status_code, response.headers, response.get_data().decode('utf-8', 'replace')
+
+class NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+class HttpSession:
+    """One simulated browser against a live server (cookies, no redirects)."""
+
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip('/')
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()), NoRedirect
+        )
+
+    def request(self, method, path, data=None, headers=None):
+        body = urllib.parse.urlencode(data).encode('utf-8') if data is not None else None
+        req = urllib.request.Request(self.base_url + path, data=body, headers=headers or {}, method=method)
+        try:
+            with self.opener.open(req, timeout=60) as response:
+                return response.status, response.headers, response.read().decode('utf-8', 'replace')
+        except urllib.error.HTTPError as e:
+            return e.code, e.headers, e.read().decode('utf-8', 'replace')
+
+class Recorder:
+    """Latencies, statuses and SQL statement counts per route."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.routes = {}
+        # thread-local statement counter, fed by the engine listener
+        self.local = threading.local()
+        self.listening = False
+
+    def listen(self, engine):
+        event.listen(engine, 'before_cursor_execute', self.count_statement)
+        self.listening = True
+
+    def count_statement(self, *args):
+        self.local.statements = getattr(self.local, 'statements', 0) + 1
+
+    def timed(self, route, session, method, path, data=None, expect=(200, 302), headers=None):
+        self.local.statements = 0
+        start = time.perf_counter()
+        status, headers, body = session.request(method, path, data, headers)
+        elapsed = time.perf_counter() - start
+        statements = self.local.statements if self.listening else sql_header_count(headers)
+        with self.lock:
+            entry = self.routes.setdefault(
+                route, {'latencies': [], 'errors': 0, 'busy': 0, 'statements': 0, 'sql_samples': 0}
+            )
+            entry['latencies'].append(elapsed)
+            if statements is not None:
+                entry['statements'] += statements
+                entry['sql_samples'] += 1
+            if status == 503:
+                entry['busy'] += 1
+            elif status not in expect:
+                entry['errors'] += 1
+        return status, headers, body
+
+    def timed_retry(self, route, session, method, path, data, expect, attempts=10):
+        """Retries hashing admission-control 503s after Retry-After, like a patient user."""
+        for _ in range(attempts):
+            status, headers, body = self.timed(route, session, method, path, data, expect)
+            if status != 503:
+                break
+            time.sleep(float(headers.get('Retry-After') or 1))
+        return status, headers, body
+
+def sql_header_count(headers):
+    """Statement count from X-SQL-Stats ('count=5; time_ms=...'), if sent."""
+    match = re.match(r'count=(\d+)', headers.get('X-SQL-Stats') or '')
+    return int(match.group(1)) if match else None
+
+def csrf_token(body):
+    match = csrf_pattern.search(body)
+    return match.group(1) if match else ''
+
+def simulate(recorder, session, username):
+    """signup -> login -> (play -> view_answer -> rate [-> stats]) x rounds"""
+    _, _, body = session.request('GET', '/signup')
+    recorder.timed_retry('signup', session, 'POST', '/signup', {
+        'csrf_token': csrf_token(body), 'username': username, 'password': args.password
+    }, expect=(302,))
+    _, _, body = session.request('GET', '/login')
+    status, headers, _ = recorder.timed_retry('login', session, 'POST', '/login', {
+        'csrf_token': csrf_token(body), 'username': username, 'password': args.password
+    }, expect=(302,))
+    # a failed login redirects to /signup instead
+    if status != 302 or not headers.get('Location', '').endswith('/play'):
+        return
+    for round_number in range(args.rounds):
+        _, _, body = recorder.timed('play', session, 'GET', '/play', expect=(200,))
+        _, _, body = recorder.timed('view_answer', session, 'POST', '/view_answer', {
+            'csrf_token': csrf_token(body)
+        }, expect=(200,))
+        recorder.timed('rate', session, 'POST', '/play', {
+            'csrf_token': csrf_token(body), 'feedback': ratings[round_number % len(ratings)]
+        }, expect=(302,))
+        if (round_number + 1) % args.stats_every == 0:
+            recorder.timed('stats', session, 'GET', '/stats', expect=(200,))
+            # the page is cheap; the chart render is the slow part
+            _, headers, _ = recorder.timed('stats_chart', session, 'GET', '/stats/chart.png', expect=(200,))
+            # a reload with nothing new rated: the browser revalidates
+            etag = headers.get('ETag')
+            if etag:
+                recorder.timed('chart_304', session, 'GET', '/stats/chart.png', expect=(304,), headers={
+                    'If-None-Match': etag
+                })
+
+def summarize(recorder, wall_time):
+    routes = {}
+    for route, entry in recorder.routes.items():
+        latencies = sorted(entry['latencies'])
+        n = len(latencies)
+        routes[route] = {
+            'requests': n
+            , 'errors': entry['errors']
+            , 'busy_503': entry['busy']
+            , 'rps': round(n / wall_time, 1)
+            , 'mean_ms': round(1000 * sum(latencies) / n, 2)
+            , 'p50_ms': round(1000 * percentile(latencies, 50), 2)
+            , 'p95_ms': round(1000 * percentile(latencies, 95), 2)
+            , 'p99_ms': round(1000 * percentile(latencies, 99), 2)
+            , 'sql_per_request': (
+                round(entry['statements'] / entry['sql_samples'], 2) if entry['sql_samples'] else None
+            )
+        }
+    total = sum(route['requests'] for route in routes.values())
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'commit': commit
+        , 'target': args.url or 'test-client'
+        , 'users': args.users
+        , 'rounds': args.rounds
+        , 'wall_s': round(wall_time, 2)
+        , 'requests': total
+        , 'rps': round(total / wall_time, 1)
+        , 'errors': sum(route['errors'] for route in routes.values())
+        , 'routes': routes
+    }
+
+def print_comparison(results, baseline):
+    print(f"\n{'route':<12} {'metric':<16} {'before':>10} {'after':>10} {'change':>8}")
+    for route, after in results['routes'].items():
+        before = baseline.get('routes', {}).get(route)
+        if before is None:
+            continue
+        for metric in ['rps', 'p50_ms', 'p95_ms', 'p99_ms', 'sql_per_request']:
+            if before.get(metric) is None or after.get(metric) is None:
+                continue
+            change = f"{100 * (after[metric] / before[metric] - 1):+.1f}%" if before[metric] else ''
+            print(f"{route:<12} {metric:<16} {before[metric]:>10} {after[metric]:>10} {change:>8}")
+
+def main():
+    recorder = Recorder()
+    if args.url:
+        make_session = lambda i: HttpSession(args.url)
+    else:
+        puns_app, _ = import_app('loadtest.db', BETA_USERS=','.join(usernames))
+        app, db = puns_app.create_app(), puns_app.db
+        logging.disable(logging.INFO)
+        with app.app_context():
+            db.create_all()
+            seed_puns(puns_app, args.puns)
+            db.session.commit()
+            recorder.listen(db.engine)
+        make_session = lambda i: TestClientSession(app, i)
+
+    threads = [
+        threading.Thread(target=simulate, args=(recorder, make_session(i), username))
+        for i, username in enumerate(usernames)
+    ]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    results = summarize(recorder, time.perf_counter() - start)
+
+    print(json.dumps(results, indent=2))
+    if args.out:
+        with open(args.out, 'w', encoding='utf-8') as outfile:
+            json.dump(results, outfile, indent=2)
+        print(f"Results written to '{args.out}'.")
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as infile:
+            print_comparison(results, json.load(infile))
+
+if __name__ == "__main__":
+    main()
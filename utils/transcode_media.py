@@ -0,0 +1,116 @@
+import os
+import io
+import sys
+import json
+import argparse
+from PIL import Image, features
+
+# Transcodes the images in static/img (animated GIFs, PNGs and JPEGs) to
+# WebP (and AVIF when this Pillow build supports it), writing <name>.webp /
+# <name>.avif next to each source and recording sizes in static/media.json,
+# which the app's picture() template helper reads to emit <picture> sources
+# with the original as fallback. Run from the repo root, before
+# utils/build_assets.py:
+#   python utils/transcode_media.py
+# A variant is only written when it is smaller than its source. The build
+# fails if any variant on disk is larger than its source, which catches
+# stale variants left by earlier runs (e.g. of a since-replaced source, or
+# an AVIF kept around by --no-avif).
+
+img_dir = os.path.join('static', 'img')
+report_path = os.path.join('static', 'media.json')
+source_exts = ('.gif', '.png', '.jpg', '.jpeg')
+variant_exts = ('.webp', '.avif')
+
+# candidate encoder settings per format; the smallest output wins
+candidates = {
+    'webp': [
+        {'format': 'WEBP', 'lossless': True, 'method': 6}
+        , {'format': 'WEBP', 'quality': 80, 'method': 6}
+    ],
+    'avif': [
+        {'format': 'AVIF', 'quality': 60}
+    ],
+}
+
+def encode(image, settings):
+    """Encodes every frame of image with the given save() settings."""
+    buf = io.BytesIO()
+    image.seek(0)
+    image.save(buf, save_all=True, **settings)
+    return buf.getvalue()
+
+def transcode(source_path, formats):
+    """Writes the smallest variant per format; returns the report entry."""
+    source_bytes = os.path.getsize(source_path)
+    entry = {'bytes': source_bytes, 'variants': {}}
+    stem = os.path.splitext(source_path)[0]
+    with Image.open(source_path) as image:
+        for ext in formats:
+            out_path = f"{stem}.{ext}"
+            best = min((encode(image, settings) for settings in candidates[ext]), key=len)
+            if len(best) >= source_bytes:
+                # the original stays the only source; drop any stale variant
+                if os.path.exists(out_path):
+                    os.remove(out_path)
+                print(f"Skipped {out_path}: {len(best)} bytes >= source {source_bytes} bytes.")
+                continue
+            with open(out_path, 'wb') as outfile:
+                outfile.write(best)
+            entry['variants'][ext] = {
+                'path': os.path.relpath(out_path, 'static').replace(os.sep, '/')
+                , 'bytes': len(best)
+                , 'saved_pct': round(100 * (1 - len(best) / source_bytes), 1)
+            }
+    return entry
+
+def check_sizes():
+    """Names of variant files in img_dir that are larger than their source,
+    whether or not this run wrote them."""
+    names = os.listdir(img_dir)
+    sources = {os.path.splitext(name)[0]: name for name in names if name.lower().endswith(source_exts)}
+    too_large = []
+    for name in sorted(names):
+        stem, ext = os.path.splitext(name)
+        if ext.lower() in variant_exts and stem in sources:
+            source_path = os.path.join(img_dir, sources[stem])
+            if os.path.getsize(os.path.join(img_dir, name)) > os.path.getsize(source_path):
+                too_large.append(f"img/{name}")
+    return too_large
+
+def main():
+    parser = argparse.ArgumentParser(description="Transcode images to WebP/AVIF")
+    parser.add_argument('--no-avif', action='store_true', help="only write WebP variants")
+    args = parser.parse_args()
+
+    formats = ['webp']
+    if not args.no_avif:
+        if features.check('avif'):
+            formats.append('avif')
+        else:
+            print("Note: this Pillow build has no AVIF support, only writing WebP.")
+
+    report = {}
+    for name in sorted(os.listdir(img_dir)):
+        if name.lower().endswith(source_exts):
+            report[f"img/{name}"] = transcode(os.path.join(img_dir, name), formats)
+
+    too_large = check_sizes()
+    if too_large:
+        print(f"Error: transcoded assets larger than their source: {', '.join(too_large)}")
+        sys.exit(1)
+
+    with open(report_path, 'w', encoding='utf-8') as outfile:
+        json.dump(report, outfile, indent=2, sort_keys=True)
+    source_total = sum(entry['bytes'] for entry in report.values())
+    for ext in formats:
+        # bytes served to a browser supporting ext (the original where no variant won)
+        served = sum(
+            entry['variants'][ext]['bytes'] if ext in entry['variants'] else entry['bytes']
+            for entry in report.values()
+        )
+        print(f"{ext}: {served} of {source_total} source bytes ({100 * (1 - served / source_total):.1f}% saved)")
+    print(f"Report written to '{report_path}'.")
+
+if __name__ == "__main__":
+    main()
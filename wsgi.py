@@ -0,0 +1,17 @@
+import os
+from app import create_app, preload, after_fork
+
+# WSGI entry point for prefork servers, e.g. one worker per core:
+#   gunicorn --preload --workers 4 --threads 8 wsgi:app
+# With --preload the master builds the app and loads the shared read-only
+# state once (see preload); each forked worker then drops the database
+# connections it inherited, so no two processes share a socket or file.
+# Every worker, preloaded or not, starts its own log listener (see
+# gunicorn.conf.py, which gunicorn reads from the working directory).
+# Keep --threads within DB_POOL_SIZE + DB_MAX_OVERFLOW.
+# RATINGS_WRITE_BEHIND=1 wants --workers 1: only one worker writes behind,
+# the others write synchronously (see RatingWriter.claim).
+
+app = create_app()
+preload(app)
+os.register_at_fork(after_in_child=lambda: after_fork(app))